@@ -4,6 +4,11 @@ import os
 import argparse
 import sys
 import time
+import json
+from array import array
+from dataclasses import dataclass
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
 
 
 class MarkovException(Exception):
@@ -18,9 +23,406 @@ class MarkovRuntimeError(MarkovException):
     pass
 
 
+class MarkovLoopError(MarkovRuntimeError):
+    def __init__(self, length):
+        self.length = length
+        super().__init__(
+            "Algorithm execution is infinite: the word repeats every {} "
+            "replacements".format(length))
+
+
+# Aho-Corasick automaton over the left sides of the rules. find() gives
+# the first rule in table order occurring in a word and its leftmost
+# position in a single pass over the word
+class RuleMatcher:
+    # The first rules are looked for one by one with str.find, which beats
+    # a pass of the automaton while few rules are tried
+    SCAN_RULES = 16
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        # An empty left side occurs in every word, so the rules after it
+        # are never tried
+        self.fallback = None
+        for index, pattern in enumerate(patterns):
+            if pattern == "":
+                self.fallback = index
+                break
+        limit = len(patterns) if self.fallback is None else self.fallback
+        # goto[node] maps a char to the next node with failures already
+        # followed, outputs[node] are the rules ending at node or at one of
+        # its suffixes and best[node] is the first of them
+        goto = [{}]
+        best = [limit]
+        outputs = [[]]
+        for index, pattern in enumerate(patterns[:limit]):
+            node = 0
+            for char in pattern:
+                if char not in goto[node]:
+                    goto.append({})
+                    best.append(limit)
+                    outputs.append([])
+                    goto[node][char] = len(goto) - 1
+                node = goto[node][char]
+            best[node] = min(best[node], index)
+            outputs[node].append(index)
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            children = goto[node]
+            goto[node] = dict(goto[fail[node]])
+            goto[node].update(children)
+            for char, child in children.items():
+                fail[child] = goto[fail[node]].get(char, 0) if node else 0
+                queue.append(child)
+            best[node] = min(best[node], best[fail[node]])
+            outputs[node] = outputs[node] + outputs[fail[node]]
+        self.goto = goto
+        self.best = best
+        self.outputs = outputs
+        self.limit = limit
+        self.head = min(self.SCAN_RULES, limit)
+        # Chars a left side starts with. Back at the root the scan jumps
+        # to the next of them, markers of most algorithms are rare
+        self.starts = re.compile(
+            "[{}]".format(re.escape("".join(goto[0])))) if goto[0] else None
+
+    def find(self, word):
+        # (rule index, position), (None, -1) when no rule occurs
+        patterns = self.patterns
+        for index in range(self.head):
+            position = word.find(patterns[index])
+            if position >= 0:
+                return index, position
+        goto, best = self.goto, self.best
+        found = self.limit
+        position = -1
+        if self.head < self.limit and self.starts is not None:
+            search = self.starts.search
+            node = 0
+            end = 0
+            size = len(word)
+            while end < size:
+                if not node:
+                    match = search(word, end)
+                    if match is None:
+                        break
+                    end = match.start()
+                node = goto[node].get(word[end], 0)
+                if best[node] < found:
+                    found = best[node]
+                    position = end + 1 - len(patterns[found])
+                    # The rules before head don't occur
+                    if found == self.head:
+                        break
+                end += 1
+        if position >= 0:
+            return found, position
+        if self.fallback is not None:
+            return self.fallback, 0
+        return None, -1
+
+    def occurrences(self, word, start=0, stop=None):
+        # (rule index, position) of every occurrence inside word[start:stop]
+        if self.starts is None:
+            return
+        goto, outputs, patterns = self.goto, self.outputs, self.patterns
+        search = self.starts.search
+        stop = len(word) if stop is None else stop
+        node = 0
+        end = start
+        while end < stop:
+            if not node:
+                match = search(word, end, stop)
+                if match is None:
+                    return
+                end = match.start()
+            node = goto[node].get(word[end], 0)
+            for index in outputs[node]:
+                yield index, end + 1 - len(patterns[index])
+            end += 1
+
+
+# Positions of every rule's left side in the word, kept in sorted lists.
+# A replacement only rescans the window around the edit and shifts the
+# positions after it, so the next rule is found without scanning the word
+class OccurrenceIndex:
+    def __init__(self, matcher: RuleMatcher, word):
+        self.matcher = matcher
+        self.lengths = [len(pattern) for pattern in matcher.patterns[:matcher.limit]]
+        self.longest = max(self.lengths, default=0)
+        self.positions = [[] for _ in range(matcher.limit)]
+        for index, position in matcher.occurrences(word):
+            self.positions[index].append(position)
+
+    def find(self):
+        # Same as RuleMatcher.find on the current word
+        for index, positions in enumerate(self.positions):
+            if positions:
+                return index, positions[0]
+        if self.matcher.fallback is not None:
+            return self.matcher.fallback, 0
+        return None, -1
+
+    def replace(self, word, position, removed, inserted):
+        # word is the new word, where removed chars at position were
+        # replaced with inserted ones
+        delta = inserted - removed
+        for index, positions in enumerate(self.positions):
+            if not positions:
+                continue
+            # Occurrences overlapping the replaced chars are dropped
+            low = bisect_left(positions, position - self.lengths[index] + 1)
+            high = bisect_left(positions, position + removed)
+            if delta:
+                positions[low:] = [start + delta for start in positions[high:]]
+            elif low < high:
+                del positions[low:high]
+        start = max(position - self.longest + 1, 0)
+        stop = min(position + inserted + self.longest - 1, len(word))
+        window = word[start:stop]
+        for index, found in self.matcher.occurrences(window):
+            found += start
+            if found + self.lengths[index] > position and \
+                    found < position + inserted:
+                insort(self.positions[index], found)
+
+
+# Mutable word as a list of chars with a gap at the last edit. A splice
+# moves the gap there, copying only the chars between the two edits, so
+# the word isn't copied on every replacement. With hashed a digest of the
+# word is kept along with the digest of the chars before the gap, so it is
+# updated at the cost of the splice too
+class GapWord:
+    # The digest is the word in base 1 << 32, the code of every char being
+    # a digit, modulo a prime
+    BASE = 1 << 32
+    MODULUS = (1 << 64) - 59
+
+    def __init__(self, word, gap=64, hashed=False):
+        self.chars = list(word) + [""] * gap
+        self.gap_start = len(word)
+        self.gap_end = len(self.chars)
+        self.digest = self.front = None
+        if hashed:
+            self.digest = self.front = self.hash_text(word)
+
+    def __len__(self):
+        return len(self.chars) - self.gap_end + self.gap_start
+
+    @staticmethod
+    def hash_text(text, start=0):
+        # Digest of text as if it began start chars into a word
+        value = int.from_bytes(
+            text.encode("utf-32-le", "surrogatepass"), "little")
+        if start:
+            value *= pow(GapWord.BASE, start, GapWord.MODULUS)
+        return value % GapWord.MODULUS
+
+    def _move(self, position):
+        chars = self.chars
+        if self.digest is not None and position != self.gap_start:
+            if position < self.gap_start:
+                moved = -self.hash_text(
+                    "".join(chars[position:self.gap_start]), position)
+            else:
+                moved = self.hash_text("".join(chars[
+                    self.gap_end:self.gap_end + position - self.gap_start]),
+                    self.gap_start)
+            self.front = (self.front + moved) % self.MODULUS
+        if position < self.gap_start:
+            count = self.gap_start - position
+            chars[self.gap_end - count:self.gap_end] = chars[position:self.gap_start]
+            self.gap_start -= count
+            self.gap_end -= count
+        elif position > self.gap_start:
+            count = position - self.gap_start
+            chars[self.gap_start:position] = chars[self.gap_end:self.gap_end + count]
+            self.gap_start += count
+            self.gap_end += count
+
+    def splice(self, position, removed, text):
+        # Replaces removed chars at position with text
+        self._move(position)
+        if self.digest is not None:
+            # The chars after the removed ones move by the change in length
+            modulus = self.MODULUS
+            rest = self.digest - self.front - self.hash_text("".join(
+                self.chars[self.gap_end:self.gap_end + removed]), position)
+            if len(text) != removed:
+                rest *= pow(self.BASE, len(text) - removed, modulus)
+            self.front = (self.front + self.hash_text(text, position)) % modulus
+            self.digest = (self.front + rest) % modulus
+        self.gap_end += removed
+        if len(text) > self.gap_end - self.gap_start:
+            extra = max(len(text), len(self))
+            self.chars[self.gap_start:self.gap_start] = [""] * extra
+            self.gap_end += extra
+        self.chars[self.gap_start:self.gap_start + len(text)] = text
+        self.gap_start += len(text)
+
+    def __getitem__(self, key):
+        # Slices give strings, only the sliced chars are copied
+        start, stop, _ = key.indices(len(self))
+        gap = self.gap_end - self.gap_start
+        if stop <= self.gap_start:
+            return "".join(self.chars[start:stop])
+        if start >= self.gap_start:
+            return "".join(self.chars[start + gap:stop + gap])
+        return "".join(self.chars[start:self.gap_start]) + \
+            "".join(self.chars[self.gap_end:stop + gap])
+
+    def __str__(self):
+        return self[0:len(self)]
+
+
+# Step history as the rule index and the position of every replacement.
+# Words are rebuilt from the initial one when asked for
+class DeltaLog:
+    def __init__(self, initial_word, rules):
+        self.initial_word = initial_word
+        # (src, dst) of every rule, dst without the terminal dot
+        self.rules = rules
+        self.indices = array("l")
+        self.positions = array("q")
+
+    def append(self, index, position):
+        self.indices.append(index)
+        self.positions.append(position)
+
+    def __len__(self):
+        # Number of words, the initial one included, like the full history
+        return len(self.indices) + 1
+
+    def words(self):
+        word = GapWord(self.initial_word)
+        yield self.initial_word
+        for index, position in zip(self.indices, self.positions):
+            src, dst = self.rules[index]
+            word.splice(position, len(src), dst)
+            yield str(word)
+
+    def replay(self, step):
+        # Word after step replacements, 0 is the initial word
+        if not 0 <= step < len(self):
+            raise IndexError("Step {} is out of the history".format(step))
+        word = GapWord(self.initial_word)
+        for index, position in zip(self.indices[:step], self.positions[:step]):
+            src, dst = self.rules[index]
+            word.splice(position, len(src), dst)
+        return str(word)
+
+    def __getitem__(self, step):
+        return self.replay(step)
+
+
+# Bounded LRU cache of intermediate words shared by runs of one table,
+# keyed by the length and a hash of the word, see key. A finished run
+# leaves (final word, replacements, iterations and the iterations before
+# the last pass from the word on, rule uses in order of first use); a
+# running one marks its words with (None, run, replacements)
+class WordCache:
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(word):
+        # Strings are keyed by their own hash, gap words by the digest they
+        # keep, so the keys of the two never compare equal
+        if isinstance(word, GapWord):
+            return len(word), word.digest, GapWord
+        return len(word), hash(word)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def forget(self, keys, run):
+        # Drops the marks a failed run left
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is None and entry[1] is run:
+                del self.entries[key]
+
+
+# Cost of every rule, filled by execute with a profile. A pass tries the
+# rules in order up to the one that fires, the rules before it miss. A miss
+# scans the whole word, a hit scans it up to the end of the occurrence
+class RuleProfile:
+    def __init__(self):
+        self.rules = []
+        self.attempts = array("Q")
+        self.hits = array("Q")
+        self.scanned = array("Q")
+        # Seconds spent searching for every rule
+        self.time = array("d")
+
+    def cover(self, rules):
+        # Makes the counters cover the rules, a profile can sum up several
+        # runs of one table
+        self.rules = list(rules)
+        extra = len(self.rules) - len(self.attempts)
+        if extra > 0:
+            self.attempts.extend(array("Q", bytes(8 * extra)))
+            self.hits.extend(array("Q", bytes(8 * extra)))
+            self.scanned.extend(array("Q", bytes(8 * extra)))
+            self.time.extend(array("d", bytes(8 * extra)))
+
+    def report(self):
+        # (rule number, rule, attempts, hits, misses, chars scanned,
+        # seconds), the costliest rules first
+        rows = [(index + 1, rule, self.attempts[index], self.hits[index],
+                 self.attempts[index] - self.hits[index],
+                 self.scanned[index], self.time[index])
+                for index, rule in enumerate(self.rules)]
+        return sorted(rows, key=lambda row: (-row[6], -row[5], row[0]))
+
+    def write_csv(self, f):
+        f.write("rule,pattern,attempts,hits,misses,scanned,seconds\n")
+        for row in self.report():
+            f.write("{},\"{}\",{},{},{},{},{:.9f}\n".format(
+                row[0], row[1].replace('"', '""'), *row[2:]))
+
+    def save(self, path):
+        # .json or csv
+        if os.path.splitext(path)[1] == ".json":
+            keys = ("rule", "pattern", "attempts", "hits", "misses",
+                    "scanned", "seconds")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump([dict(zip(keys, row)) for row in self.report()], f,
+                          ensure_ascii=False, indent=1)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                self.write_csv(f)
+
+
+@dataclass
+class RuleIssue:
+    level: str
+    rules: tuple
+    message: str
+
+
 class Table:
     def __init__(self, array):
         self.fields = []
+        self._matcher = None
+        self._cache = None
+        self._cache_key = None
+        self._pruned = None
+        self._pruned_key = None
         self._correct_fields(array)  # rstrip alternative
 
     def add_field(self, src, dst, comment):
@@ -56,6 +458,63 @@ class Table:
         for field in array:
             self.add_field(*Table.recognize_field(field))
 
+    def matcher(self):
+        # RuleMatcher of the rules, rebuilt when they have changed
+        patterns = tuple(Table.recognize_field(field)[0] for field in self.fields)
+        if self._matcher is None or self._matcher.patterns != patterns:
+            self._matcher = RuleMatcher(patterns)
+        return self._matcher
+
+    def word_cache(self):
+        # WordCache of the rules, emptied when they have changed
+        key = tuple(Table.recognize_field(field)[:2] for field in self.fields)
+        if self._cache is None or self._cache_key != key:
+            self._cache = WordCache()
+            self._cache_key = key
+        return self._cache
+
+    def shadowed(self):
+        # Rule index -> index of the earlier rule whose left side is a part
+        # of its own. That rule occurs whenever this one does and is tried
+        # first, so this one never fires. An empty left side is a part of
+        # every word
+        sources = [Table.recognize_field(field)[0] for field in self.fields]
+        shadowed = {}
+        for index, src in enumerate(sources):
+            for earlier in range(index):
+                if sources[earlier] in src:
+                    shadowed[index] = earlier
+                    break
+        return shadowed
+
+    def analyze(self):
+        issues = []
+        for index, earlier in self.shadowed().items():
+            before = Table.recognize_field(self.fields[earlier])[0]
+            if before == "":
+                message = "Rule {} ({}) follows rule {} with an empty " \
+                          "left side and never fires"
+            else:
+                message = "Rule {} ({}) is shadowed by rule {} ({}) and never fires"
+            issues.append(RuleIssue("warning", (index + 1, earlier + 1), message.format(
+                index + 1, "->".join(Table.recognize_field(self.fields[index])[:2]),
+                earlier + 1, before)))
+        return issues
+
+    def pruned(self):
+        # (table without the shadowed rules, their indices in this table),
+        # rebuilt when the rules have changed
+        key = tuple(Table.recognize_field(field)[:2] for field in self.fields)
+        if self._pruned is None or self._pruned_key != key:
+            shadowed = self.shadowed()
+            numbers = [index for index in range(len(self.fields))
+                       if index not in shadowed]
+            table = Table([])
+            table.fields = [self.fields[index] for index in numbers]
+            self._pruned = (table, numbers)
+            self._pruned_key = key
+        return self._pruned
+
     def __iter__(self):
         return iter(self.fields)
 
@@ -147,6 +606,12 @@ class MarkovMachine:
     COMMAND_COMMENT_TEMPLATE = r"^(.{0,})->(.{0,})(\s{0,}//(.{0,}))$"
     COMMAND_TEMPLATE = r"^(.{0,})->(.{0,})$"
     SOLUTION_TEMPLATE = r"^SOLUTION\s{0,}:\s{0,}(.{0,})$"
+    ENGINES = ("scan", "index")
+    BACKENDS = ("str", "gap")
+    # Kept in trace_results: "full" and "ring" keep words in "steps", the
+    # ring only the last ring_size of them, "delta" keeps a DeltaLog in
+    # "delta" and "none" nothing
+    HISTORIES = ("none", "ring", "delta", "full")
 
     def __init__(self, object):
         self._solution = ''
@@ -226,52 +691,204 @@ class MarkovMachine:
                 input_word=None,
                 max_iterations=10000,
                 debug_prints=False,
-                delay=0):
+                delay=0,
+                engine="scan",
+                backend="str",
+                history="full",
+                ring_size=100,
+                memoize=False,
+                prune=False,
+                profile=None):
         replacements = 0
         iterations = 0
         initial_word = input_word or self.word
         word = initial_word
         trace_results = {
-            "command_exec_count": {}, "steps": [word],
+            "command_exec_count": {},
             "total_replace_templates": len(self.table)}
-        failures = 0
-        stop_iteration_flag = False
-        while failures != len(self.table) and not stop_iteration_flag:
+        if history not in self.HISTORIES:
+            raise ValueError("Unknown history: {}".format(history))
+        # (src, dst, trace key, terminal) of every rule
+        rules = []
+        for field in self.table:
+            src, dst, _ = Table.recognize_field(field)
+            if dst.startswith("."):
+                rules.append((src, dst[1:], f"{src}->.{dst[1:]}", True))
+            elif dst.endswith("."):
+                rules.append((src, dst[:-1], f"{src}->.{dst[:-1]}", True))
+            else:
+                rules.append((src, dst, f"{src}->{dst}", False))
+        # Shadowed rules are left out of the search, the rest keep their
+        # numbers, so iterations are counted as with the whole table
+        if prune:
+            live, numbers = self.table.pruned()
+        else:
+            live, numbers = self.table, None
+        matcher = live.matcher()
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown engine: {}".format(engine))
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown backend: {}".format(backend))
+        if backend == "gap" and engine != "index":
+            raise ValueError("Gap buffer backend requires the index engine")
+        # Runs keeping words can't be cut short
+        if memoize and history != "none":
+            raise ValueError("Memoization requires the \"none\" history")
+        if memoize and debug_prints:
+            raise ValueError("Memoization can't be used with debug prints")
+        if memoize and profile is not None:
+            raise ValueError("Memoization can't be used with a profile")
+        # The index pays off on long runs, the scan on short ones. A profile
+        # times the rules one by one and needs neither
+        occurrences = None
+        if engine == "index" and profile is None:
+            occurrences = OccurrenceIndex(matcher, word)
+        if profile is not None:
+            profile.cover(rule[2] for rule in rules)
+            tried = numbers if numbers is not None else range(len(rules))
+        if backend == "gap":
+            word = GapWord(word, hashed=memoize)
+        steps = log = None
+        if history == "full":
+            steps = trace_results["steps"] = [initial_word]
+        elif history == "ring":
+            steps = deque([initial_word], maxlen=ring_size)
+        elif history == "delta":
+            log = trace_results["delta"] = DeltaLog(
+                initial_word, [rule[:2] for rule in rules])
+        cache = None
+        if memoize:
+            cache = self.table.word_cache()
+            run = object()
+            # (word key, iterations, replacements, trace key) of the last
+            # passes
+            passes = deque(maxlen=cache.capacity)
+        last_pass = iterations
+        cached = None
+        # A pass tries the rules in order, every tried rule is an iteration
+        stop_iteration_flag = not rules
+        while not stop_iteration_flag:
+            if cache is not None:
+                key = WordCache.key(word)
+                entry = cache.get(key)
+                if entry is not None and entry[0] is not None:
+                    if iterations + entry[3] > max_iterations:
+                        cache.forget([item[0] for item in passes], run)
+                        raise MarkovRuntimeError("Max iterations limit has reached")
+                    cached = entry
+                    break
+                if entry is not None and entry[1] is run:
+                    cache.forget([item[0] for item in passes], run)
+                    raise MarkovLoopError(replacements - entry[2])
+                cache.put(key, (None, run, replacements))
             if iterations > max_iterations:
+                if cache is not None:
+                    cache.forget([item[0] for item in passes], run)
                 raise MarkovRuntimeError("Max iterations limit has reached")
-            failures = 0
-            for field in self.table:
-                src, dst, _ = Table.recognize_field(field)
-                if src in word:
-                    if dst.startswith("."):
-                        stop_iteration_flag = True
-                        dst = dst[1:]
-                        replacement_pattern = f"{src}->.{dst}"
-                    elif dst.endswith("."):
-                        stop_iteration_flag = True
-                        dst = dst[:-1]
-                        replacement_pattern = f"{src}->.{dst}"
-                    else:
-                        replacement_pattern = f"{src}->{dst}"
-                    replacements += 1
-                    trace_results["command_exec_count"].setdefault(replacement_pattern, 0)
-                    trace_results["command_exec_count"][replacement_pattern] += 1
-                    if src == "":
-                        word = dst + word
-                    else:
-                        word = word.replace(src, dst, 1)
-                    if debug_prints:
-                        print(src, "->", dst, ":", word)
-                    trace_results["steps"].append(word)
-                    iterations += 1
-                    break
+            last_pass = iterations
+            if profile is not None:
+                index, position = self._profiled_find(
+                    str(word), rules, tried, profile)
+            elif occurrences is None:
+                index, position = matcher.find(word)
+            else:
+                index, position = occurrences.find()
+            if numbers is not None and index is not None and profile is None:
+                index = numbers[index]
+            if cache is not None:
+                passes.append((key, iterations, replacements,
+                               None if index is None else rules[index][2]))
+            if index is None:
+                iterations += len(rules)
+                stop_iteration_flag = True
+            else:
+                src, dst, replacement_pattern, stop_iteration_flag = rules[index]
+                replacements += 1
+                trace_results["command_exec_count"].setdefault(replacement_pattern, 0)
+                trace_results["command_exec_count"][replacement_pattern] += 1
+                if backend == "gap":
+                    word.splice(position, len(src), dst)
                 else:
-                    failures += 1
-                iterations += 1
-            time.sleep(delay)
+                    word = word[:position] + dst + word[position + len(src):]
+                if occurrences is not None:
+                    occurrences.replace(word, position, len(src), len(dst))
+                if debug_prints:
+                    print(src, "->", dst, ":", str(word))
+                if steps is not None:
+                    steps.append(str(word))
+                elif log is not None:
+                    log.append(index, position)
+                iterations += index + 1
+            if delay:
+                time.sleep(delay)
+        if cached is not None:
+            word, more_replacements, more_iterations, before_last, uses = cached
+            last_pass = iterations + before_last
+            replacements += more_replacements
+            iterations += more_iterations
+            for replacement_pattern, count in uses:
+                trace_results["command_exec_count"].setdefault(replacement_pattern, 0)
+                trace_results["command_exec_count"][replacement_pattern] += count
+        if cache is not None:
+            self._remember(cache, passes, str(word), replacements,
+                           iterations, last_pass, cached)
+        if history == "ring":
+            trace_results["steps"] = list(steps)
         trace_results["replacements"] = replacements
         trace_results["iterations"] = iterations
-        return initial_word, word, trace_results
+        return initial_word, str(word), trace_results
+
+    @staticmethod
+    def _profiled_find(word, rules, tried, profile):
+        # The first rule occurring in the word and its position, searched
+        # for rule by rule into profile
+        clock = time.perf_counter
+        length = len(word)
+        for index in tried:
+            src = rules[index][0]
+            start = clock()
+            position = word.find(src)
+            profile.time[index] += clock() - start
+            profile.attempts[index] += 1
+            if position >= 0:
+                profile.hits[index] += 1
+                profile.scanned[index] += position + len(src)
+                return index, position
+            profile.scanned[index] += length
+        return None, None
+
+    @staticmethod
+    def _remember(cache, passes, word, replacements, iterations, last_pass,
+                  cached):
+        # Caches the outcome from every pass of a finished run on, uses of
+        # the rules are added up from the end
+        uses = dict(cached[4]) if cached is not None else {}
+        order = list(uses)
+        for key, before, replaced, replacement_pattern in reversed(passes):
+            if replacement_pattern is not None:
+                if replacement_pattern in uses:
+                    uses[replacement_pattern] += 1
+                    order.remove(replacement_pattern)
+                else:
+                    uses[replacement_pattern] = 1
+                order.insert(0, replacement_pattern)
+            cache.put(key, (word, replacements - replaced, iterations - before,
+                            last_pass - before,
+                            tuple((name, uses[name]) for name in order)))
+
+    def execute_batch(self, words, max_iterations=10000, history="none",
+                      **kwargs):
+        # Runs every word, no history is kept unless asked for. Gives the
+        # results of execute per word, or the MarkovRuntimeError of a
+        # failed run in its place
+        results = []
+        for word in words:
+            try:
+                results.append(self.execute(
+                    word, max_iterations, history=history, **kwargs))
+            except MarkovRuntimeError as e:
+                results.append(e)
+        return results
 
 
 def compile_file(path):
@@ -291,11 +908,16 @@ if __name__ == "__main__":
         prog="Altturing"
     )
 
-    parser.add_argument("action", help="Основное действие:compile,execute,view")
+    parser.add_argument("action", help="Основное действие:compile,execute,view,check")
     parser.add_argument("path", help="Основной файл для работы")
     parser.add_argument("--notrace", action="store_true", help="Вывести только результат, без статистики")
     parser.add_argument("-w", "--word", action="store", help="Исходное слово")
     parser.add_argument("-d", "--debug", action="store_true", default=False, help="Включить пошаговое отображение")
+    parser.add_argument("-b", "--backend", choices=MarkovMachine.BACKENDS, default="str", help="Представление слова: str - строка, gap - буфер с разрывом (только с -e index)")
+    parser.add_argument("-p", "--prune", action="store_true", default=False, help="Не проверять правила, которые никогда не применяются")
+    parser.add_argument("-e", "--engine", choices=MarkovMachine.ENGINES, default="scan", help="Способ поиска замен: scan - просмотр слова, index - индекс вхождений")
+    parser.add_argument("--profile", action="store_true", default=False, help="Показать затраты на поиск каждого правила")
+    parser.add_argument("--profile-file", action="store", help="Файл для записи профиля правил (.json или .csv)")
 
     args = parser.parse_args()
     if args.action == "compile":
@@ -311,13 +933,16 @@ if __name__ == "__main__":
             program = compile_file(args.path)
         else:
             program = MarkovMachine(MarkovFile.from_bytes(args.path))
+        profile = RuleProfile() if args.profile or args.profile_file else None
         try:
             if args.word:
                 initial_word = args.word
             else:
                 initial_word = None
             initial_word, word, results = program.execute(
-                initial_word, debug_prints=args.debug)
+                initial_word, debug_prints=args.debug, engine=args.engine,
+                backend=args.backend, history="none", prune=args.prune,
+                profile=profile)
             print(initial_word, "->", word)
             if not args.notrace:
                 print("Выполнено замен:", results["replacements"])
@@ -330,6 +955,22 @@ if __name__ == "__main__":
                     print(key, results["command_exec_count"][key])
         except MarkovRuntimeError as e:
             print("Ошибка:", str(e), file=sys.stderr)
+        if args.profile:
+            print("Профиль правил (правило, попытки, успехи, промахи, просмотрено символов, время в мс):")
+            for number, rule, attempts, hits, misses, scanned, seconds in profile.report():
+                print(f"{number}. {rule} {attempts} {hits} {misses} {scanned} {seconds * 1000:.3f}")
+        if args.profile_file:
+            profile.save(args.profile_file)
+    elif args.action == "check":
+        if os.path.splitext(args.path)[1] != ".nma":
+            program = compile_file(args.path)
+        else:
+            program = MarkovMachine(MarkovFile.from_bytes(args.path))
+        issues = program.table.analyze()
+        for issue in issues:
+            print(f"{issue.level}: {issue.message}")
+        if not issues:
+            print("Ошибок не найдено")
     elif args.action == "view":
         if os.path.splitext(args.path)[1] != ".nma":
             program = compile_file(args.path)
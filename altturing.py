@@ -1,10 +1,24 @@
 import io
+import mmap
 import os.path
+import struct
+import zlib
+from array import array
 from dataclasses import dataclass
+from typing import NamedTuple
 import re
 import sys
 import time
 import argparse
+import hashlib
+import heapq
+import warnings
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 class TuringException(Exception):
@@ -19,20 +33,499 @@ class TuringCompileException(TuringException):
     pass
 
 
+class TuringWarning(UserWarning):
+    pass
+
+
+class TuringLoopError(TuringRuntimeError):
+    def __init__(self, start, length, shift=0):
+        self.start = start
+        self.length = length
+        self.shift = shift
+        if shift:
+            message = "Machine execution is infinite: from step {} it " \
+                      "moves {} cells every {} steps".format(start, shift, length)
+        else:
+            message = "Machine execution is infinite: from step {} the " \
+                      "configuration repeats every {} steps".format(start, length)
+        super().__init__(message)
+
+
+# Tape symbols are interned by their cp1251 code, the encoding of .tur files
+CHARS = bytes(range(256)).decode("cp1251", errors="replace")
+UNDEFINED = 0x98  # the only byte cp1251 leaves unassigned
+CODES = {char: code for code, char in enumerate(CHARS) if code != UNDEFINED}
+BLANK = CODES[" "]
+SHIFTS = {">": 1, ".": 0, "<": -1}
+# Tape hash is the sum of (code - BLANK) * HASH_BASE ** position
+HASH_BASE = 1000003
+HASH_MODULUS = (1 << 61) - 1
+HASH_INVERSE = pow(HASH_BASE, -1, HASH_MODULUS)
+# Written symbol, move and next state of an action, see Table.split_action
+ACTION_TEMPLATE = re.compile(r"(.)([>.<])([0-9]+)", re.S)
+NO_ACTION = -1
+INVALID_ACTION = -2
+# Compiled runs of tables by table digest and counting, the least recently
+# used are dropped past the limit, see DecodedTable.compiled
+COMPILED_RUNS = OrderedDict()
+COMPILED_RUN_LIMIT = 64
+
+
+# Table lowered to dense integer arrays indexed by state * WIDTH + code.
+# Undefined cells hold NO_ACTION as the next state, unparsable ones
+# INVALID_ACTION; actions keeps the source strings for traces and errors
+class DecodedTable:
+    WIDTH = 256
+    BLOCK_CACHE_LIMIT = 1 << 16
+
+    def __init__(self, table):
+        self.q_count = table.q_count
+        columns = {}
+        # Column symbol -> code, in table order
+        self.symbols = {}
+        states = max(table.q_count, 1)
+        for symbol, column in table.columns().items():
+            if symbol == "_":
+                code = BLANK
+            elif len(symbol) == 1 and symbol in CODES:
+                code = CODES[symbol]
+            else:
+                continue
+            self.symbols[symbol] = code
+            column = column[:table.q_count]
+            columns[code] = [(x, self.parse_action(x)) for x in column]
+            for _, parsed in columns[code]:
+                if parsed is not None and parsed[2] > states:
+                    states = parsed[2]
+        # Rows are allocated up to the highest referenced state, so jumps
+        # beyond q_count land on undefined cells instead of out of range
+        self.states = states
+        size = (states + 1) * self.WIDTH
+        self.write = [BLANK] * size
+        self.shift = [0] * size
+        self.next_state = [NO_ACTION] * size
+        self.actions = [None] * size
+        self.block_caches = {}
+        rows = b"".join(table.rows())
+        self.checksum = zlib.crc32(rows)
+        self.digest = hashlib.sha256(
+            rows + table.q_count.to_bytes(4, "little")).digest()
+        # Self-loops like "a q1: a>q1" sweep over a run of their symbol
+        self.sweep = [False] * size
+        for code, column in columns.items():
+            for state, (action, parsed) in enumerate(column, 1):
+                index = state * self.WIDTH + code
+                self.actions[index] = action
+                if parsed is None:
+                    self.next_state[index] = INVALID_ACTION
+                else:
+                    self.write[index], self.shift[index], \
+                        self.next_state[index] = parsed
+                    self.sweep[index] = bool(parsed[2] == state and parsed[1]
+                                             and parsed[0] == code)
+        # Whitespace and "_" are read as a blank, like Table.action does
+        if BLANK in columns:
+            width = self.WIDTH
+            stop = (len(columns[BLANK]) + 1) * width
+            # States moving on over a blank, a sweep if they write code
+            loops = [state for state in range(1, len(columns[BLANK]) + 1)
+                     if self.next_state[state * width + BLANK] == state
+                     and self.shift[state * width + BLANK]]
+            for code, char in enumerate(CHARS):
+                if code != BLANK and (char.strip() == "" or char == "_"):
+                    # Column of code in every state takes the blank one
+                    src = slice(width + BLANK, stop, width)
+                    dst = slice(width + code, stop, width)
+                    for cells in (self.write, self.shift, self.next_state,
+                                  self.actions, self.sweep):
+                        cells[dst] = cells[src]
+                    for state in loops:
+                        self.sweep[state * width + code] = \
+                            self.write[state * width + BLANK] == code
+
+    def failure(self, index):
+        # Error of a step that found no action in cell index
+        if self.next_state[index] == INVALID_ACTION:
+            return TuringRuntimeError(
+                "Invalid action command: {}".format(self.actions[index]))
+        return TuringRuntimeError(
+            "Action for this state {} and char {} wasn't found".format(
+                index // self.WIDTH, CHARS[index % self.WIDTH]))
+
+    @staticmethod
+    def limit_error():
+        return TuringRuntimeError(
+            "Max iteration limit has reached. "
+            "Maybe, machine execution is infinite")
+
+    def block_cache(self, size):
+        return self.block_caches.setdefault(size, {})
+
+    def run_block(self, state, block, offset, limit):
+        # Runs the machine on block alone until the head leaves it or the
+        # machine halts. Gives None when a step fails or limit is reached,
+        # otherwise (block, offset, state, steps, lowest read, highest read,
+        # uses of table cells in order of first use)
+        width = self.WIDTH
+        write, shift, next_state = self.write, self.shift, self.next_state
+        cells = bytearray(block)
+        size = len(cells)
+        low = high = offset
+        steps = 0
+        counts = {}
+        while state != 0 and 0 <= offset < size:
+            if steps == limit:
+                return None
+            index = state * width + cells[offset]
+            state = next_state[index]
+            if state < 0:
+                return None
+            if offset < low:
+                low = offset
+            elif offset > high:
+                high = offset
+            counts[index] = counts.get(index, 0) + 1
+            cells[offset] = write[index]
+            offset += shift[index]
+            steps += 1
+        return (bytes(cells), offset, state, steps, low, high,
+                tuple(counts.items()))
+
+    def fingerprints(self, state, cells, pointer):
+        # Endless (state, pointer, tape hash) sequence of configurations
+        # from the given one, cells maps positions to codes
+        tape_hash = sum(
+            (code - BLANK) * pow(HASH_BASE, position, HASH_MODULUS)
+            for position, code in cells.items()) % HASH_MODULUS
+        while True:
+            yield state, pointer, tape_hash
+            if state == 0:
+                return
+            code = cells.get(pointer, BLANK)
+            index = state * self.WIDTH + code
+            state = self.next_state[index]
+            if state < 0:
+                return
+            tape_hash = (tape_hash + (self.write[index] - code) * pow(
+                HASH_BASE, pointer, HASH_MODULUS)) % HASH_MODULUS
+            cells[pointer] = self.write[index]
+            pointer += self.shift[index]
+
+    def compiled(self, counting):
+        # Run function specialized to this table, see generate_source
+        key = (self.digest, counting)
+        run = COMPILED_RUNS.get(key)
+        if run is not None:
+            COMPILED_RUNS.move_to_end(key)
+        else:
+            namespace = {"limit_error": DecodedTable.limit_error,
+                         "BLANK": BLANK}
+            code = compile(self.generate_source(counting),
+                           "<turing table>", "exec")
+            exec(code, namespace)
+            run = COMPILED_RUNS[key] = namespace["run"]
+            if len(COMPILED_RUNS) > COMPILED_RUN_LIMIT:
+                COMPILED_RUNS.popitem(last=False)
+        return run
+
+    def generate_source(self, counting):
+        # Python source of run(execution, max_iterations), which does what
+        # Execution.run does. Every state is a function looping on the code
+        # read while the state doesn't change and giving the next state,
+        # run looks it up by state number. Only the side the head moves to
+        # is checked for growing the tape
+        width = self.WIDTH
+        right = [
+            "if position > high:",
+            "    high = position",
+            "    if position > end:",
+            "        end = position",
+            "    if position >= size:",
+            "        buffer.reach(position)",
+            "        size = len(buf)",
+        ]
+        left = [
+            "if position < low:",
+            "    low = position",
+            "    if position < begin:",
+            "        begin = position",
+            "    if position < 0:",
+            "        position, begin, end, low, high = buffer.reach(",
+            "            position, begin, end, low, high)",
+            "        origin = buffer.origin",
+            "        size = len(buf)",
+        ]
+        limit_error = ["raise limit_error()"]
+
+        def indent(block, level):
+            return ["    " * level + line for line in block]
+
+        def count(codes, base):
+            index = str(base + codes[0]) if len(codes) == 1 else "index"
+            block = [] if len(codes) == 1 else ["index = {} + code".format(base)]
+            if counting:
+                block += ["if not counts[{}]:".format(index),
+                          "    used.append({})".format(index),
+                          "counts[{}] += 1".format(index)]
+            return block, index
+
+        lines = [
+            "def run(execution, max_iterations):",
+            "    buffer = execution.buffer",
+            "    failure = execution.table.failure",
+            "    counts, used = execution.counts, execution.used",
+            "    state = execution.state",
+            "    iterations = execution.iterations",
+            "    buf = buffer.buffer",
+            "    origin = buffer.origin",
+            "    size = len(buf)",
+            "    position = buffer.pointer - origin",
+            "    begin = buffer.begin - origin",
+            "    end = buffer.end - origin",
+            "    low = execution.low - origin",
+            "    high = execution.high - origin",
+        ]
+        for state in range(1, self.states + 1):
+            base = state * width
+            groups = {}
+            for code in range(width):
+                index = base + code
+                if self.next_state[index] == NO_ACTION:
+                    continue
+                key = (self.write[index], self.shift[index],
+                       self.next_state[index], self.actions[index],
+                       self.sweep[index])
+                groups.setdefault(key, []).append(code)
+            lines.append("    def state_{}():".format(state))
+            lines.append("        nonlocal position, iterations, size, origin, "
+                         "begin, end, low, high")
+            lines.append("        while True:")
+            body = ["if iterations > max_iterations:"]
+            body += indent(limit_error, 1)
+            body.append("code = buf[position]")
+            first = True
+            for (write, shift, new_state, action, sweep), codes in groups.items():
+                if len(codes) == 1:
+                    test = "code == {}".format(codes[0])
+                else:
+                    test = "code in {{{}}}".format(", ".join(map(str, codes)))
+                body.append("{}if {}:".format("" if first else "el", test))
+                first = False
+                if new_state == INVALID_ACTION:
+                    body.append("    raise failure({})".format(base + codes[0]))
+                    continue
+                block, index = count(codes, base)
+                if sweep:
+                    # The whole run is passed at once, as Execution.steps does
+                    block += [
+                        "step = {}".format(shift),
+                        "count = buffer.span(position, code, step)",
+                        "allowed = max_iterations + 1 - iterations",
+                        "if count >= allowed:",
+                        "    count = allowed",
+                        "elif code == BLANK and not 0 <= position + count * step < size \\",
+                        "        and buffer.blank_beyond(step):",
+                    ]
+                    block += indent(limit_error, 1)
+                    if counting:
+                        block.append("counts[{}] += count - 1".format(index))
+                    block += ["iterations += count",
+                              "position += count * step"]
+                    block += right if shift > 0 else left
+                    block.append("continue")
+                    body += indent(block, 1)
+                    continue
+                if any(code != write for code in codes):
+                    block.append("buf[position] = {}".format(write))
+                if shift:
+                    block.append("position {}= 1".format("+" if shift > 0 else "-"))
+                block.append("iterations += 1")
+                if new_state != 0 and shift:
+                    block += right if shift > 0 else left
+                if new_state == state:
+                    block.append("continue")
+                else:
+                    block.append("return {}".format(new_state))
+                body += indent(block, 1)
+            body.append("raise failure({} + code)".format(base))
+            lines += indent(body, 3)
+        lines.append("    handlers = [None, {}]".format(", ".join(
+            "state_{}".format(state) for state in range(1, self.states + 1))))
+        lines += ["    try:", "        if state != 0:"]
+        lines += indent(right, 3) + indent(["el" + left[0]] + left[1:], 3)
+        lines += [
+            "        while state != 0:",
+            "            state = handlers[state]()",
+            "    finally:",
+            "        if position > high:",
+            "            high = position",
+            "        elif position < low:",
+            "            low = position",
+            "        buffer.pointer = origin + position",
+            "        buffer.begin = origin + begin",
+            "        buffer.end = origin + end",
+            "        execution.low = origin + low",
+            "        execution.high = origin + high",
+            "        execution.state = state",
+            "        execution.iterations = iterations",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def reachable(self):
+        # States reachable from q1, in order of discovery
+        if not self.q_count:
+            return []
+        reachable = [1]
+        seen = {1}
+        for state in reachable:
+            for code in self.symbols.values():
+                target = self.next_state[state * self.WIDTH + code]
+                if 0 < target <= self.q_count and target not in seen:
+                    reachable.append(target)
+                    seen.add(target)
+        return reachable
+
+    def analyze(self):
+        # Static checks of the states reachable from q1. Errors fail or
+        # never end whenever the transition is taken, warnings never end
+        # when taken on the blank tape past the written part
+        width = self.WIDTH
+        issues = []
+        reachable = self.reachable()
+        for state in reachable:
+            base = state * width
+            if not any(self.actions[base + code] for code in self.symbols.values()):
+                issues.append(TableIssue("error", (state,), (
+                    "State q{} is reachable but has no actions").format(state)))
+            for symbol, code in self.symbols.items():
+                action = self.actions[base + code]
+                target = self.next_state[base + code]
+                if not action:
+                    continue
+                elif target == INVALID_ACTION:
+                    issues.append(TableIssue("error", (state,), (
+                        "Invalid action command for state q{} and "
+                        "char {}: {}").format(state, symbol, action)))
+                elif target > self.q_count:
+                    issues.append(TableIssue("error", (state,), (
+                        "State q{} jumps to undefined state q{}").format(
+                        state, target)))
+                elif not self.shift[base + code] and target:
+                    # Looked up as Table.action does
+                    written = "_" if action[0].strip() == "" else action[0]
+                    if written not in self.symbols or not self.actions[
+                            target * width + self.symbols[written]]:
+                        issues.append(TableIssue("error", (state, target), (
+                            "State q{} leaves {} under the head, but q{} "
+                            "has no action for it").format(
+                            state, action[0], target)))
+        nodes = [(state, code) for state in reachable
+                 for code in self.symbols.values()]
+        for cycle in self._cycles(nodes, 0):
+            states = tuple(dict.fromkeys(state for state, _ in cycle))
+            issues.append(TableIssue("error", states, (
+                "States {} loop forever without moving the head").format(
+                ", ".join("q{}".format(state) for state in states))))
+        for shift, direction in ((1, "right"), (-1, "left")):
+            for cycle in self._cycles([(q, BLANK) for q in reachable], shift):
+                states = tuple(dict.fromkeys(state for state, _ in cycle))
+                if not any(self.shift[state * width + code]
+                           for state, code in cycle):
+                    continue
+                issues.append(TableIssue("warning", states, (
+                    "States {} move {} over blanks forever once past "
+                    "the written tape").format(
+                    ", ".join("q{}".format(state) for state in states),
+                    direction)))
+        return issues
+
+    def _cycles(self, starts, shift):
+        # Cycles of the head on a cell, when shift is 0, or on the blank
+        # tape ahead of it in the shift direction. Every node (state,
+        # code under the head) has at most one successor
+        def follow(node):
+            index = node[0] * self.WIDTH + node[1]
+            target = self.next_state[index]
+            if not 0 < target <= self.q_count:
+                return None
+            if not self.shift[index]:
+                code = self.symbols.get(self.actions[index][0])
+                return None if code is None else (target, code)
+            if self.shift[index] == shift:
+                return target, BLANK
+            return None
+
+        cycles = []
+        done = set()
+        for node in starts:
+            path = {}
+            while node is not None and node not in done and node not in path:
+                path[node] = len(path)
+                node = follow(node)
+            if node is not None and node in path:
+                cycles.append(list(path)[path[node]:])
+            done.update(path)
+        return cycles
+
+    @staticmethod
+    def parse_action(action):
+        # Table.split_action splits at the first of ">", "." and "<" found,
+        # so the symbol mustn't be one coming before the move
+        match = ACTION_TEMPLATE.fullmatch(action)
+        if match is None:
+            return None
+        symbol, char, state = match.groups()
+        if symbol in ">.<"[:">.<".index(char) + 1]:
+            return None
+        symbol = " " if symbol == "_" else symbol
+        if symbol not in CODES:
+            return None
+        return CODES[symbol], SHIFTS[char], int(state)
+
+
 class Table:
-    def __init__(self, fields, q_count):
+    def __init__(self, fields, q_count, source=None):
         self._q_count = q_count
+        # Table section of a .tur file, parsed into fields on first use
+        self._source = source
+        self._fields = None
+        self._decoded = None
+        if fields is not None:
+            self._set_fields(fields)
+
+    def _set_fields(self, fields):
+        self._fields = self._complete(fields)
+
+    def _complete(self, fields):
         if "_" not in fields:
-            fields["_"] = ["" for i in range(q_count)]
+            fields["_"] = ["" for i in range(self._q_count)]
         if " " in fields:
             fields["_"] = fields[" "]
             fields.pop(" ")
-        self._fields = fields
+        return fields
 
     @property
     def fields(self):
+        if self._fields is None:
+            self._set_fields(self.parse_rows(
+                self._source.split(b"\r\n"), self._q_count))
+            self._source = None
         return self._fields
 
+    def columns(self):
+        # Same as fields, but a table section that wasn't parsed stays so.
+        # Loading only decodes it, see DecodedTable
+        if self._fields is not None:
+            return self._fields
+        return self._complete(self.parse_rows(
+            self._source.split(b"\r\n"), self._q_count))
+
+    @property
+    def decoded(self):
+        if self._decoded is None:
+            self._decoded = DecodedTable(self)
+        return self._decoded
+
     def action(self, symbol, state):
         if symbol.strip() == "":
             symbol = "_"
@@ -41,36 +534,138 @@ class Table:
         else:
             return None
 
+    @staticmethod
+    def split_action(action):
+        # "a>2" -> ("a", ">", 2), None for an empty or malformed action
+        for char in ">.<":
+            if char in action:
+                break
+        else:
+            return None
+        parts = action.split(char)
+        if len(parts) != 2 or len(parts[0]) != 1 \
+                or not parts[1].isdigit():
+            return None
+        return parts[0], char, int(parts[1])
+
     def set_action(self, symbol, state, new_symbol, action, new_state):
         if 0 < state <= self.q_count and symbol in self.fields.keys() \
                 and new_symbol in self.fields.keys() and action in "<>.":
             # new_state mustn't be checked
             self.fields[symbol][state - 1] = (new_symbol + action + str(new_state))
+            self._decoded = None
             return True
         else:
             return False
 
+    def rows(self):
+        # Table section of a .tur file, a line per item. A table that
+        # wasn't parsed is given back as it was read
+        if self._fields is None:
+            return [self._source]
+        rows = [b"\t" + b"\t".join([
+            b"Q" + bytes(str(x), "cp1251")
+            for x in range(1, self.q_count + 1)]) + b"\r\n"]
+        for field, column in self._fields.items():
+            rows.append(field.encode("cp1251") + b"\t" +
+                        "\t".join(column).encode("cp1251") + b"\r\n")
+        return rows
+
     def to_bytes(self):
-        buf = b"\t" + b"\t".join([
-            b"Q" + bytes(str(x), "cp1251") for x in range(1, self.q_count + 1)])
-        buf += b"\r\n"
-        for field in self.fields:
-            if field == b"_":
-                buf += b" "
-            else:
-                buf += field.encode("cp1251")
-            buf += b"\t" + b"\t".join(
-                map(lambda x: x.encode("cp1251"), self.fields[field]))
-            if field != b" ":
-                buf += b"\r\n"
+        buf = b"".join(self.rows())
         return buf, len(buf)
 
     @property
     def q_count(self):
         return self._q_count
 
+    def reachable(self):
+        # States reachable from q1, in order of discovery
+        return self.decoded.reachable()
+
+    def analyze(self):
+        # Static checks of the states reachable from q1, see
+        # DecodedTable.analyze
+        return self.decoded.analyze()
+
+    def optimize(self, symbols=()):
+        # Drops states unreachable from q1, merges states that behave the
+        # same and drops columns that are neither read nor written, unless
+        # listed in symbols. States are renumbered in order of reachability
+        if not self.q_count:
+            return Table(dict(self.fields), 0)
+        reachable = self.reachable()
+
+        def cell(state, symbol, blocks):
+            action = self.fields[symbol][state - 1]
+            parsed = self.split_action(action)
+            if parsed is None:
+                return action,
+            if parsed[2] in blocks:
+                target = blocks[parsed[2]]
+            elif parsed[2] == 0:
+                target = "halt"
+            else:
+                # States beyond q_count all fail the same way
+                target = "undefined"
+            return parsed[0], parsed[1], target
+
+        # Moore's partition refinement, starting from a single block
+        blocks = dict.fromkeys(reachable, 0)
+        while True:
+            signatures = {}
+            refined = {}
+            for state in reachable:
+                signature = (blocks[state],) + tuple(
+                    cell(state, symbol, blocks) for symbol in self.fields)
+                refined[state] = signatures.setdefault(
+                    signature, len(signatures))
+            if len(signatures) == len(set(blocks.values())):
+                break
+            blocks = refined
+        # The first state of every block stands for it
+        numbers = {}
+        for state in reachable:
+            numbers.setdefault(blocks[state], len(numbers) + 1)
+        states = {}
+        for state in reachable:
+            states.setdefault(numbers[blocks[state]], state)
+        q_count = len(states)
+
+        def rewrite(action):
+            parsed = self.split_action(action)
+            if parsed is None:
+                return action
+            symbol, char, state = parsed
+            if state in blocks:
+                state = numbers[blocks[state]]
+            elif state:
+                state = q_count + 1
+            return symbol + char + str(state)
+
+        fields = {}
+        kept = [states[q] for q in range(1, q_count + 1)]
+        written = set()
+        for column in self.fields.values():
+            for state in kept:
+                action = self.split_action(column[state - 1])
+                if action:
+                    written.add(action[0])
+        for symbol, column in self.fields.items():
+            if symbol == "_" or symbol in written or symbol in symbols \
+                    or any(column[state - 1] for state in kept):
+                fields[symbol] = [rewrite(column[state - 1]) for state in kept]
+        return Table(fields, q_count)
+
     @classmethod
     def from_bytes(cls, source, q_count):
+        # Takes the table section, or a list of its lines
+        if isinstance(source, list):
+            return cls(cls.parse_rows(source, q_count), q_count)
+        return cls(None, q_count, bytes(source))
+
+    @staticmethod
+    def parse_rows(source, q_count):
         source = source[1:-1]
         fields = {}
         for field in source:
@@ -79,9 +674,18 @@ class Table:
                 field[0] = "_"
             else:
                 field[0] = field[0].decode("cp1251")
-            fields[field[0]] = list(
-                map(lambda x: x.decode("cp1251"), field[1:][:q_count]))
-        return cls(fields, q_count)
+            # Decoded a row at once
+            cells = field[1:][:q_count]
+            fields[field[0]] = b"\t".join(cells).decode(
+                "cp1251").split("\t") if cells else []
+        return fields
+
+
+@dataclass
+class TableIssue:
+    level: str
+    states: tuple
+    message: str
 
 
 @dataclass
@@ -92,6 +696,234 @@ class Tape:
     tape: str
 
 
+# One executed step: the state and head position before it, the symbols
+# read and written and the state after it
+class Step(NamedTuple):
+    index: int
+    state: int
+    pointer: int
+    read: str
+    written: str
+    next_state: int
+
+
+# Mutable tape storing cp1251 codes. buffer[0] is the cell at origin,
+# begin and end keep the Tape meaning and the buffer grows by doubling
+class TapeBuffer:
+    def __init__(self, tape: Tape):
+        try:
+            data = tape.tape.encode("cp1251")
+        except UnicodeEncodeError:
+            raise TuringRuntimeError(
+                "Tape has symbols outside of cp1251: {}".format(
+                    repr(tape.tape)))
+        self.buffer = bytearray(data or bytes([BLANK]))
+        self.origin = tape.begin
+        self.begin = tape.begin
+        self.end = tape.end
+        self.pointer = tape.pointer
+        # Tape.tape may be longer or shorter than [begin, end]
+        self._tail = tape.begin + len(data) - 1 - tape.end
+        self.cover_head()
+
+    @classmethod
+    def restore(cls, buffer, origin, begin, end, pointer, tail):
+        # Snapshots are kept between steps, where the head may stand past
+        # end until the next step, so they are taken back as they are
+        tape = cls.__new__(cls)
+        tape.buffer = buffer
+        tape.origin = origin
+        tape.begin = begin
+        tape.end = end
+        tape.pointer = pointer
+        tape._tail = tail
+        return tape
+
+    def cover_head(self):
+        # The head may start outside of [begin, end]. The tape is widened
+        # to it before the run, as the first step of execute always did,
+        # so the run loops only check the cells the head moves to
+        self.begin = min(self.begin, self.pointer)
+        self.end = max(self.end, self.pointer)
+        self.grow(self.pointer)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def grow(self, position):
+        # Makes the buffer cover position, at least doubling it
+        size = len(self.buffer)
+        if position < self.origin:
+            extra = max(size, self.origin - position)
+            self.buffer[0:0] = bytes([BLANK]) * extra
+            self.origin -= extra
+        elif position >= self.origin + size:
+            extra = max(size, position - self.origin - size + 1)
+            self.buffer.extend(bytes([BLANK]) * extra)
+
+    def reach(self, *offsets):
+        # Grows the buffer to cover the cell at the first of offsets into
+        # it. The offsets are given back moved along with its start
+        origin = self.origin
+        self.grow(origin + offsets[0])
+        moved = origin - self.origin
+        if not moved:
+            return offsets
+        return tuple(offset + moved for offset in offsets)
+
+    def span(self, index, code, shift):
+        # Number of cells holding code from buffer index on in the shift
+        # direction, not looking past the buffer
+        buf = self.buffer
+        symbol = bytes([code])
+        count = 0
+        chunk = 64
+        while True:
+            if shift > 0:
+                piece = buf[index + count:index + count + chunk]
+                rest = len(piece.lstrip(symbol))
+            else:
+                stop = index - count + 1
+                piece = buf[max(stop - chunk, 0):stop]
+                rest = len(piece.rstrip(symbol))
+            count += len(piece) - rest
+            if rest or len(piece) < chunk:
+                return count
+            chunk *= 2
+
+    def blank_beyond(self, shift):
+        # Whether every cell past the buffer in the shift direction is blank
+        return True
+
+    def load(self):
+        # Copies cells kept outside of the buffer into it, here they are
+        # all blank
+        pass
+
+    def cells(self, start, stop):
+        return self.window(self.buffer, self.origin, start, stop)
+
+    def write(self, f, chunk=1 << 20):
+        # Writes the cells to_tape would give, a chunk at a time
+        stop = self.end + self._tail + 1
+        for start in range(self.begin, stop, chunk):
+            f.write(self.cells(start, min(start + chunk, stop)))
+
+    def content(self):
+        # First and last positions of non-blank cells, None if all blank
+        data = self.buffer.lstrip(bytes([BLANK]))
+        if not data:
+            return None
+        first = self.origin + len(self.buffer) - len(data)
+        last = self.origin + len(self.buffer.rstrip(bytes([BLANK]))) - 1
+        return first, last
+
+    def hash(self):
+        result = 0
+        for index, code in enumerate(self.buffer):
+            if code != BLANK:
+                result += (code - BLANK) * pow(
+                    HASH_BASE, self.origin + index, HASH_MODULUS)
+        return result % HASH_MODULUS
+
+    @staticmethod
+    def window(data, origin, start, stop):
+        # Cells [start, stop) of data placed at origin, blanks outside it
+        head = max(0, min(origin, stop) - start)
+        tail = max(0, stop - max(origin + len(data), start))
+        inner = data[max(start - origin, 0):max(stop - origin, 0)]
+        return bytes([BLANK]) * head + bytes(inner) + bytes([BLANK]) * tail
+
+    def __getitem__(self, position):
+        index = position - self.origin
+        if 0 <= index < len(self.buffer):
+            return CHARS[self.buffer[index]]
+        return " "
+
+    def to_tape(self, tape=None):
+        # Updates tape in place, if given, as execute always did
+        self.grow(self.begin)
+        self.grow(self.end + self._tail)
+        start = self.begin - self.origin
+        stop = self.end + self._tail - self.origin + 1
+        word = self.buffer[start:stop].decode("cp1251")
+        if tape is None:
+            return Tape(self.begin, self.end, self.pointer, word)
+        tape.begin, tape.end = self.begin, self.end
+        tape.pointer, tape.tape = self.pointer, word
+        return tape
+
+
+# TapeBuffer over a tape file, its bytes are the cells from 0 on. The file
+# is mapped and only the cells the head reaches are copied into buffer
+class MappedTapeBuffer(TapeBuffer):
+    CHUNK = 1 << 16
+
+    def __init__(self, path, pointer=0):
+        with open(path, "rb") as f:
+            try:
+                self.source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                self.source = b""
+        start = pointer - self.CHUNK // 2
+        self.buffer = bytearray(
+            self.window(self.source, 0, start, start + self.CHUNK))
+        self.origin = start
+        self.begin = 0
+        self.end = max(len(self.source) - 1, 0)
+        self.pointer = pointer
+        self._tail = 0
+        self.cover_head()
+
+    def grow(self, position):
+        size = len(self.buffer)
+        if position < self.origin:
+            extra = max(size, self.origin - position)
+            self.buffer[0:0] = self.window(
+                self.source, 0, self.origin - extra, self.origin)
+            self.origin -= extra
+        elif position >= self.origin + size:
+            extra = max(size, position - self.origin - size + 1)
+            stop = self.origin + size
+            self.buffer.extend(self.window(self.source, 0, stop, stop + extra))
+
+    def blank_beyond(self, shift):
+        if shift > 0:
+            return self.origin + len(self.buffer) >= len(self.source)
+        return self.origin <= 0
+
+    def load(self):
+        if len(self.source):
+            self.grow(0)
+            self.grow(len(self.source) - 1)
+
+    def cells(self, start, stop):
+        data = bytearray(self.window(self.source, 0, start, stop))
+        low = max(start, self.origin)
+        high = min(stop, self.origin + len(self.buffer))
+        if low < high:
+            data[low - start:high - start] = \
+                self.buffer[low - self.origin:high - self.origin]
+        return bytes(data)
+
+    def content(self):
+        # Loop detection needs the whole tape
+        self.load()
+        return super().content()
+
+    def hash(self):
+        self.load()
+        return super().hash()
+
+    def __getitem__(self, position):
+        return CHARS[self.cells(position, position + 1)[0]]
+
+    def close(self):
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+
+
 class TuringFile:
     def __init__(self, table: Table, tape: Tape, comment="", solution=""):
         self._table = table
@@ -115,16 +947,15 @@ class TuringFile:
     def tape(self):
         return self._tape
 
-    def to_bytes(self):
-        f = io.BytesIO()
+    def write(self, f):
         comment = self._comment.encode("cp1251")
         solution = self._solution.encode("cp1251")
         f.write(len(solution).to_bytes(4, "little"))
         f.write(solution)
         f.write((self.table.q_count + 1).to_bytes(4, "little"))
-        table, table_length = self.table.to_bytes()
-        f.write(table_length.to_bytes(4, "little"))
-        f.write(table)
+        table = self.table.rows()
+        f.write(sum(map(len, table)).to_bytes(4, "little"))
+        f.writelines(table)
         f.write(len(comment).to_bytes(4, "little"))
         f.write(comment)
         if self.tape.begin < 0:
@@ -143,100 +974,947 @@ class TuringFile:
         f.write(end.to_bytes(4, "little"))
         f.write(pointer.to_bytes(4, "little"))
         f.write(self.tape.tape.encode("cp1251"))
+
+    def to_bytes(self):
+        f = io.BytesIO()
+        self.write(f)
         result = f.getvalue()
         f.close()
         return result
 
-    def _recount(self, q, fields):
-        fields = list(fields)
-        for i in range(len(fields)):
-            if not len(fields[i]):
-                continue
-            char, commands = self._split_commands(fields[i])
-            state = int(commands[-1])
-            if state != 0:
-                new_state = (state - 1) + q
-                commands[-1] = str(new_state)
-            fields[i] = char.join(commands)
-        return fields
-
-    def _split_commands(self, command):
-        if ">" in command:
-            char = ">"
-        elif "." in command:
-            char = "."
-        elif "<" in command:
-            char = "<"
-        else:
-            raise ValueError("Invalid command: {}".format(command))
-        return char, command.split(char)
+    def optimize(self):
+        symbols = set(self.tape.tape)
+        if " " in symbols:
+            symbols.add("_")
+        return TuringFile(self.table.optimize(symbols), self.tape,
+                          self._comment, self._solution)
 
     def merge(self, other):
         if not isinstance(other, TuringFile):
             raise TypeError("Required TuringFile object for merging")
-        new_q = self.table.q_count + other.table.q_count
-        next_q = self.table.q_count + 1
-        fields_1 = dict(self.table.fields)
-        fields_2 = dict(other.table.fields)
-        for field in fields_1:
-            for i in range(len(fields_1[field])):
-                if not len(fields_1[field][i]):
-                    continue
-                char, commands = self._split_commands(fields_1[field][i])
-                if int(commands[-1]) == 0:
-                    commands[-1] = str(next_q)
-                fields_1[field][i] = char.join(commands)
-        for field in fields_2:
-            if field not in fields_1:
-                fields_1[field] = ["" for i in range(self.table.q_count)] + \
-                    self._recount(next_q, fields_2[field])
-            else:
-                fields_1[field] += self._recount(next_q, fields_2[field])
-        table = Table(fields_1, new_q)
-        return TuringFile(table, self.tape, self._comment, self._solution)
+        return link_programs([self, other])
 
     @classmethod
     def from_bytes(cls, source):
         if isinstance(source, cls):
             return source
-        elif isinstance(source, bytes):
-            f = io.BytesIO(source)
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            return cls.parse(source)
         elif isinstance(source, io.BytesIO):
-            f = source
-        else:
-            f = open(source, "rb")
-
-        solution_length = int.from_bytes(f.read(4), "little")
-        solution = f.read(solution_length).decode("cp1251")
-
-        q_count = int.from_bytes(f.read(4), "little") - 1
-        table_length = int.from_bytes(f.read(4), "little")
-        table = f.read(table_length).split(b"\r\n")
-        comment_length = int.from_bytes(f.read(4), "little")
-        comment = f.read(comment_length).decode("cp1251")
-        begin = int.from_bytes(f.read(4), "little")
-        end = int.from_bytes(f.read(4), "little")
-        pointer = int.from_bytes(f.read(4), "little")
+            return cls.parse(source.getbuffer()[source.tell():])
+        with open(source, "rb") as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                data = f.read()
+        return cls.parse(data)
+
+    @classmethod
+    def parse(cls, data):
+        # Reads the sections in place, only the table section is copied
+        # and its cells are decoded when first needed
+        view = memoryview(data)
+        offset = 0
+
+        def read(length):
+            nonlocal offset
+            offset += length
+            return view[offset - length:offset]
+
+        solution_length = int.from_bytes(read(4), "little")
+        solution = str(read(solution_length), "cp1251")
+
+        q_count = int.from_bytes(read(4), "little") - 1
+        table_length = int.from_bytes(read(4), "little")
+        table = Table.from_bytes(read(table_length), q_count)
+        comment_length = int.from_bytes(read(4), "little")
+        comment = str(read(comment_length), "cp1251")
+        begin = int.from_bytes(read(4), "little")
+        end = int.from_bytes(read(4), "little")
+        pointer = int.from_bytes(read(4), "little")
         if 2**32 - begin < (2**32) / 2:
             begin = -(2 ** 32 - begin)
         if 2**32 - end < (2**32) / 2:
             end = -(2**32 - end)
         if 2**32 - pointer < (2**32) / 2:
             pointer = -(2 ** 32 - pointer)
-        tape = f.read().decode("cp1251")
-        tape = Tape(begin, end, pointer, tape)
-        table = Table.from_bytes(table, q_count)
-        f.close()
+        tape = Tape(begin, end, pointer, str(view[offset:], "cp1251"))
+        view.release()
         return cls(table, tape, comment, solution)
 
 
+# Where the head spends its time, filled by Execution.run_profiled
+class TapeProfile:
+    SWEEP_COUNT = 10
+
+    def __init__(self):
+        # Steps made on every cell, visits[i] is cell origin + i
+        self.origin = 0
+        self.visits = array("Q")
+        self.reversals = 0
+        # Cells moved in every state, by state number
+        self.distance = array("Q")
+        # Longest runs of moves in one direction as (length, first cell,
+        # last cell), a min-heap
+        self.sweeps = []
+
+    def cover(self, start, stop):
+        # Makes visits cover cells [start, stop)
+        if not self.visits:
+            self.origin = start
+        if start < self.origin:
+            self.visits[0:0] = array("Q", bytes(8 * (self.origin - start)))
+            self.origin = start
+        extra = stop - self.origin - len(self.visits)
+        if extra > 0:
+            self.visits.extend(array("Q", bytes(8 * extra)))
+
+    def add_sweep(self, length, first, last):
+        if len(self.sweeps) < self.SWEEP_COUNT:
+            heapq.heappush(self.sweeps, (length, first, last))
+        elif length > self.sweeps[0][0]:
+            heapq.heappushpop(self.sweeps, (length, first, last))
+
+    def longest_sweeps(self):
+        return sorted(self.sweeps, reverse=True)
+
+    def histogram(self):
+        # (cell, visits) from the first to the last visited cell
+        visited = [index for index, count in enumerate(self.visits) if count]
+        if not visited:
+            return []
+        return [(self.origin + index, self.visits[index])
+                for index in range(visited[0], visited[-1] + 1)]
+
+    def write_csv(self, f):
+        f.write("cell,visits\n")
+        for cell, count in self.histogram():
+            f.write("{},{}\n".format(cell, count))
+
+    def save(self, path):
+        # .npz with numpy, csv otherwise
+        if os.path.splitext(path)[1] == ".npz":
+            if np is None:
+                raise TuringException("numpy is required for .npz export")
+            histogram = self.histogram()
+            np.savez(
+                path,
+                cells=np.array([cell for cell, _ in histogram], dtype=np.int64),
+                visits=np.array([count for _, count in histogram], dtype=np.uint64),
+                distance=np.array(self.distance, dtype=np.uint64),
+                sweeps=np.array(self.longest_sweeps(), dtype=np.int64).reshape(-1, 3),
+                reversals=np.int64(self.reversals))
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                self.write_csv(f)
+
+
+# Configuration of a running machine with its trace counters. Both run
+# loops leave it consistent, so a run may switch between them
+class Execution:
+    BLOCK_STEP_LIMIT = 10000
+    BLOCK_WARMUP = 1024
+    BLOCK_MISS_RATIO = 0.5
+
+    TRACE_LEVELS = ("none", "summary", "full")
+    # Magic, table checksum, trace level, state, initial state, iterations,
+    # buffer origin, pointer, begin, end, lowest and highest cell, tail.
+    # The tape buffer and the used table cells with their counts follow
+    CHECKPOINT_HEADER = struct.Struct("<8sIB10q")
+    CHECKPOINT_MAGIC = b"TURCKPT1"
+
+    def __init__(self, table: DecodedTable, buffer: TapeBuffer, state=1,
+                 trace="full"):
+        if trace not in self.TRACE_LEVELS:
+            raise ValueError("Unknown trace level: {}".format(trace))
+        self.table = table
+        self.buffer = buffer
+        self.state = state
+        self.initial_state = state
+        self.iterations = 0
+        self.low = self.high = buffer.pointer
+        self.trace = trace
+        # Uses of every table cell and the cells in order of first use,
+        # only kept for the full trace
+        self.counts = [0] * len(table.next_state) if trace == "full" else None
+        self.used = []
+        # Table cell -> step of its first use, kept by the plain run with
+        # the full trace when set to a dict
+        self.first_use = None
+
+    def trace_results(self):
+        results = {"iterations": self.iterations}
+        if self.trace == "none":
+            return results
+        results["used_cells"] = self.high - self.low + 1
+        results["head_range"] = (self.low, self.high)
+        if self.trace == "summary":
+            return results
+        command_exec_count = {}
+        state_use_count = {self.initial_state: 1}
+        for index in self.used:
+            action = self.table.actions[index]
+            state = self.table.next_state[index]
+            command_exec_count[action] = \
+                command_exec_count.get(action, 0) + self.counts[index]
+            state_use_count[state] = \
+                state_use_count.get(state, 0) + self.counts[index]
+        results["command_exec_count"] = command_exec_count
+        results["state_use_count"] = state_use_count
+        return results
+
+    def run(self, max_iterations, checkpoint=None, every=None, until=None):
+        # With a checkpoint path the run is saved there every `every`
+        # steps, when it stops and when it fails
+        if checkpoint is None:
+            for _ in self.steps(max_iterations, until=until):
+                pass
+            return
+        try:
+            while self.state != 0:
+                pause = self.iterations + every if every else None
+                if until is not None:
+                    pause = until if pause is None else min(pause, until)
+                for _ in self.steps(max_iterations, until=pause):
+                    pass
+                self.save(checkpoint)
+                if self.iterations == until:
+                    break
+        except TuringRuntimeError:
+            self.save(checkpoint)
+            raise
+
+    def save(self, path):
+        buffer = self.buffer
+        buffer.load()
+        used = array("q")
+        for index in self.used:
+            used.append(index)
+            used.append(self.counts[index])
+        if sys.byteorder == "big":
+            used.byteswap()
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(self.CHECKPOINT_HEADER.pack(
+                self.CHECKPOINT_MAGIC, self.table.checksum,
+                self.TRACE_LEVELS.index(self.trace), self.state,
+                self.initial_state, self.iterations, buffer.origin,
+                buffer.pointer, buffer.begin, buffer.end, self.low,
+                self.high, buffer._tail))
+            f.write(len(buffer.buffer).to_bytes(8, "little"))
+            f.write(buffer.buffer)
+            f.write(len(self.used).to_bytes(8, "little"))
+            f.write(used.tobytes())
+        # A crash while saving leaves the previous checkpoint intact
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, table: DecodedTable):
+        with open(path, "rb") as f:
+            data = f.read()
+        header = cls.CHECKPOINT_HEADER
+        if len(data) < header.size or \
+                header.unpack_from(data)[0] != cls.CHECKPOINT_MAGIC:
+            raise TuringRuntimeError("Not a checkpoint file: {}".format(path))
+        (_, checksum, trace, state, initial_state, iterations, origin,
+         pointer, begin, end, low, high, tail) = header.unpack_from(data)
+        if checksum != table.checksum:
+            raise TuringRuntimeError(
+                "Checkpoint {} was made for another table".format(path))
+        offset = header.size
+        size = int.from_bytes(data[offset:offset + 8], "little")
+        offset += 8
+        buffer = TapeBuffer.restore(
+            bytearray(data[offset:offset + size]),
+            origin, begin, end, pointer, tail)
+        offset += size
+        execution = cls(table, buffer, initial_state, cls.TRACE_LEVELS[trace])
+        execution.state = state
+        execution.iterations = iterations
+        execution.low, execution.high = low, high
+        size = int.from_bytes(data[offset:offset + 8], "little")
+        offset += 8
+        used = array("q", data[offset:offset + 16 * size])
+        if sys.byteorder == "big":
+            used.byteswap()
+        if execution.counts is not None:
+            for index, count in zip(used[::2], used[1::2]):
+                execution.used.append(index)
+                execution.counts[index] = count
+        return execution
+
+    def steps(self, max_iterations, records=False, until=None):
+        # The interpreter loop. Yields a Step after every step with
+        # records, and nothing otherwise, running to the end at once.
+        # It pauses, without an error, when until iterations are reached
+        if until is None:
+            limit = max_iterations
+        else:
+            limit = min(max_iterations, until - 1)
+        buffer = self.buffer
+        state = self.state
+        iterations = self.iterations
+        counts, used = self.counts, self.used
+        first_use = self.first_use
+        decoded = self.table
+        width = decoded.WIDTH
+        write, shift = decoded.write, decoded.shift
+        next_state = decoded.next_state
+        if records:
+            sweep = [False] * len(decoded.sweep)
+        else:
+            sweep = decoded.sweep
+        # The loop works on offsets into buffer.buffer, which are moved
+        # when the buffer grows to the left. TapeBuffer.cover_head has the
+        # head inside [begin, end] and the buffer already, so bounds and
+        # growth are only checked for cells past low and high, here and in
+        # run_profiled, run_watched and the compiled run
+        buf = buffer.buffer
+        origin = buffer.origin
+        size = len(buf)
+        position = buffer.pointer - origin
+        begin = buffer.begin - origin
+        end = buffer.end - origin
+        low = self.low - origin
+        high = self.high - origin
+        try:
+            while state != 0:
+                if position > high:
+                    high = position
+                    if position > end:
+                        end = position
+                    if position >= size:
+                        buffer.reach(position)
+                        size = len(buf)
+                elif position < low:
+                    low = position
+                    if position < begin:
+                        begin = position
+                    if position < 0:
+                        position, begin, end, low, high = buffer.reach(
+                            position, begin, end, low, high)
+                        origin = buffer.origin
+                        size = len(buf)
+                if iterations > limit:
+                    if iterations > max_iterations:
+                        raise decoded.limit_error()
+                    break
+                index = state * width + buf[position]
+                new_state = next_state[index]
+                if new_state < 0:
+                    raise decoded.failure(index)
+                if counts is not None:
+                    if not counts[index]:
+                        used.append(index)
+                        if first_use is not None:
+                            first_use[index] = iterations
+                    counts[index] += 1
+                if sweep[index]:
+                    # The whole run is passed at once. A run of blanks
+                    # reaching the end of the buffer never ends
+                    code = buf[position]
+                    step = shift[index]
+                    count = buffer.span(position, code, step)
+                    allowed = limit + 1 - iterations
+                    if count >= allowed:
+                        count = allowed
+                    elif code == BLANK and not 0 <= position + count * step < size \
+                            and buffer.blank_beyond(step):
+                        raise decoded.limit_error()
+                    if counts is not None:
+                        counts[index] += count - 1
+                    iterations += count
+                    position += count * step
+                    continue
+                if records:
+                    record = Step(iterations, state, origin + position,
+                                  CHARS[buf[position]], CHARS[write[index]],
+                                  new_state)
+                buf[position] = write[index]
+                position += shift[index]
+                state = new_state
+                iterations += 1
+                if records:
+                    buffer.pointer = origin + position
+                    buffer.begin, buffer.end = origin + begin, origin + end
+                    self.low = origin + min(low, position)
+                    self.high = origin + max(high, position)
+                    self.state, self.iterations = state, iterations
+                    yield record
+        finally:
+            # The head may stop one cell past everything read so far
+            if position > high:
+                high = position
+            elif position < low:
+                low = position
+            buffer.pointer = origin + position
+            buffer.begin = origin + begin
+            buffer.end = origin + end
+            self.low = origin + low
+            self.high = origin + high
+            self.state = state
+            self.iterations = iterations
+
+    def run_compiled(self, max_iterations):
+        # Execution.run through the table's compiled run function
+        self.table.compiled(self.counts is not None)(self, max_iterations)
+
+    def run_profiled(self, max_iterations, profile: TapeProfile):
+        # Single stepping that counts visits of cells, head reversals,
+        # sweeps and moves per state into profile
+        buffer = self.buffer
+        state = self.state
+        iterations = self.iterations
+        counts, used = self.counts, self.used
+        decoded = self.table
+        width = decoded.WIDTH
+        write, shift = decoded.write, decoded.shift
+        next_state = decoded.next_state
+        buf = buffer.buffer
+        origin = buffer.origin
+        size = len(buf)
+        position = buffer.pointer - origin
+        begin = buffer.begin - origin
+        end = buffer.end - origin
+        low = self.low - origin
+        high = self.high - origin
+        profile.cover(origin, origin + size)
+        visits = profile.visits
+        # visits index of the buffer start
+        offset = origin - profile.origin
+        distance = profile.distance
+        states = len(next_state) // width
+        if len(distance) < states:
+            distance.extend(array("Q", bytes(8 * (states - len(distance)))))
+        reversals = 0
+        direction = 0
+        sweep_start = position
+        try:
+            while state != 0:
+                if position > high:
+                    high = position
+                    if position > end:
+                        end = position
+                    if position >= size:
+                        buffer.reach(position)
+                        size = len(buf)
+                        profile.cover(origin, origin + size)
+                elif position < low:
+                    low = position
+                    if position < begin:
+                        begin = position
+                    if position < 0:
+                        position, begin, end, low, high, sweep_start = \
+                            buffer.reach(position, begin, end, low, high,
+                                         sweep_start)
+                        origin = buffer.origin
+                        size = len(buf)
+                        profile.cover(origin, origin + size)
+                        offset = origin - profile.origin
+                if iterations > max_iterations:
+                    raise decoded.limit_error()
+                index = state * width + buf[position]
+                new_state = next_state[index]
+                if new_state < 0:
+                    raise decoded.failure(index)
+                if counts is not None:
+                    if not counts[index]:
+                        used.append(index)
+                    counts[index] += 1
+                visits[position + offset] += 1
+                step = shift[index]
+                if step:
+                    distance[state] += 1
+                    if step != direction:
+                        if direction:
+                            reversals += 1
+                            profile.add_sweep(abs(position - sweep_start),
+                                              origin + sweep_start,
+                                              origin + position)
+                        direction = step
+                        sweep_start = position
+                buf[position] = write[index]
+                position += step
+                state = new_state
+                iterations += 1
+        finally:
+            if direction:
+                profile.add_sweep(abs(position - sweep_start),
+                                  origin + sweep_start, origin + position)
+            profile.reversals += reversals
+            if position > high:
+                high = position
+            elif position < low:
+                low = position
+            buffer.pointer = origin + position
+            buffer.begin = origin + begin
+            buffer.end = origin + end
+            self.low = origin + low
+            self.high = origin + high
+            self.state = state
+            self.iterations = iterations
+
+    def run_watched(self, max_iterations):
+        # Single stepping that proves non-termination. Exact repeats of
+        # (state, head, tape hash) are found with Brent's algorithm, which
+        # keeps one saved configuration. A cycle translated along the tape
+        # shows as two records of the head with the same state, when the
+        # cells read in between look the same behind both records
+        buffer = self.buffer
+        decoded = self.table
+        width = decoded.WIDTH
+        write, shift = decoded.write, decoded.shift
+        next_state = decoded.next_state
+        state = self.state
+        iterations = start = self.iterations
+        counts, used = self.counts, self.used
+        buffer.load()
+        initial = (state, bytes(buffer.buffer), buffer.origin, buffer.pointer)
+        buf = buffer.buffer
+        origin = buffer.origin
+        pointer = buffer.pointer
+        begin, end = buffer.begin, buffer.end
+        low, high = self.low, self.high
+        tape_hash = buffer.hash()
+        power = pow(HASH_BASE, pointer, HASH_MODULUS)
+        saved = (state, pointer, tape_hash)
+        passed, limit = 0, 1
+        # Beyond these edges the tape is blank and was never visited
+        content = buffer.content() or (pointer, pointer)
+        left_edge, right_edge = min(low, content[0]), max(high, content[1])
+        left = right = None
+        left_max = right_min = pointer
+        left_records = right_records = 0
+        left_limit = right_limit = 1
+        try:
+            while state != 0:
+                if pointer > high:
+                    high = pointer
+                    if pointer > end:
+                        end = pointer
+                        if pointer - origin >= len(buf):
+                            buffer.grow(pointer)
+                elif pointer < low:
+                    low = pointer
+                    if pointer < begin:
+                        begin = pointer
+                        if pointer < origin:
+                            buffer.grow(pointer)
+                            origin = buffer.origin
+                if pointer < right_min:
+                    right_min = pointer
+                if pointer > left_max:
+                    left_max = pointer
+                if pointer > right_edge:
+                    right_edge = pointer
+                    if right is not None and right[0] == state:
+                        moved = pointer - right[1]
+                        if TapeBuffer.window(right[3], right[4], right_min, right[1]) == \
+                                TapeBuffer.window(buf, origin, right_min + moved, pointer):
+                            raise TuringLoopError(
+                                right[2], iterations - right[2], moved)
+                    right_records += 1
+                    if right_records == right_limit:
+                        right = (state, pointer, iterations, bytes(buf), origin)
+                        right_min = pointer
+                        right_records = 0
+                        right_limit *= 2
+                elif pointer < left_edge:
+                    left_edge = pointer
+                    if left is not None and left[0] == state:
+                        moved = pointer - left[1]
+                        if TapeBuffer.window(left[3], left[4], left[1] + 1, left_max + 1) == \
+                                TapeBuffer.window(buf, origin, pointer + 1, left_max + moved + 1):
+                            raise TuringLoopError(
+                                left[2], iterations - left[2], moved)
+                    left_records += 1
+                    if left_records == left_limit:
+                        left = (state, pointer, iterations, bytes(buf), origin)
+                        left_max = pointer
+                        left_records = 0
+                        left_limit *= 2
+                if iterations > max_iterations:
+                    raise decoded.limit_error()
+                code = buf[pointer - origin]
+                index = state * width + code
+                new_state = next_state[index]
+                if new_state < 0:
+                    raise decoded.failure(index)
+                if counts is not None:
+                    if not counts[index]:
+                        used.append(index)
+                    counts[index] += 1
+                if write[index] != code:
+                    buf[pointer - origin] = write[index]
+                    tape_hash = (tape_hash + (write[index] - code) * power) % HASH_MODULUS
+                if shift[index] > 0:
+                    power = power * HASH_BASE % HASH_MODULUS
+                elif shift[index] < 0:
+                    power = power * HASH_INVERSE % HASH_MODULUS
+                pointer += shift[index]
+                state = new_state
+                iterations += 1
+                passed += 1
+                if tape_hash == saved[2] and pointer == saved[1] and state == saved[0]:
+                    raise TuringLoopError(
+                        start + self.cycle_start(initial, passed), passed)
+                if passed == limit:
+                    saved = (state, pointer, tape_hash)
+                    passed = 0
+                    limit *= 2
+        finally:
+            if pointer > high:
+                high = pointer
+            elif pointer < low:
+                low = pointer
+            buffer.pointer = pointer
+            buffer.begin, buffer.end = begin, end
+            self.low, self.high = low, high
+            self.state = state
+            self.iterations = iterations
+
+    def cycle_start(self, initial, length):
+        # Steps from the initial configuration to the first one repeated
+        # length steps later, found by running two copies length apart
+        state, data, origin, pointer = initial
+        cells = {origin + index: code for index, code in enumerate(data)
+                 if code != BLANK}
+        tortoise = self.table.fingerprints(state, dict(cells), pointer)
+        hare = self.table.fingerprints(state, cells, pointer)
+        for _ in range(length):
+            next(hare)
+        for steps, (first, second) in enumerate(zip(tortoise, hare)):
+            if first == second:
+                return steps
+
+    def run_blocks(self, block_size, max_iterations):
+        # Macro-machine mode: the tape is split into blocks of block_size
+        # cells and the whole pass of the head through a block is taken
+        # from the table's cache. Counters of cached passes are added up
+        # per pass and expanded when the mode is left
+        buffer = self.buffer
+        cache = self.table.block_cache(block_size)
+        used = {}
+        passes = misses = 0
+        try:
+            while self.state != 0:
+                pointer = buffer.pointer
+                base = pointer - pointer % block_size
+                buffer.grow(base)
+                buffer.grow(base + block_size - 1)
+                start = base - buffer.origin
+                block = bytes(buffer.buffer[start:start + block_size])
+                key = (self.state, block, pointer - base)
+                passes += 1
+                entry = cache.get(key)
+                if entry is None:
+                    misses += 1
+                    if passes > self.BLOCK_WARMUP and \
+                            misses > passes * self.BLOCK_MISS_RATIO:
+                        break
+                    entry = self.table.run_block(
+                        self.state, block, pointer - base,
+                        self.BLOCK_STEP_LIMIT)
+                    if entry is None:
+                        break
+                    if len(cache) < self.table.BLOCK_CACHE_LIMIT:
+                        cache[key] = entry
+                cells, offset, state, steps, low, high = entry[:6]
+                # Exceeding the limit inside the pass is left to run,
+                # so the error is raised at the same step
+                if self.iterations + steps > max_iterations + 1:
+                    break
+                buffer.buffer[start:start + block_size] = cells
+                buffer.pointer = base + offset
+                buffer.begin = min(buffer.begin, base + low)
+                buffer.end = max(buffer.end, base + high)
+                self.low = min(self.low, base + low, buffer.pointer)
+                self.high = max(self.high, base + high, buffer.pointer)
+                self.state = state
+                self.iterations += steps
+                if key in used:
+                    used[key][1] += 1
+                else:
+                    used[key] = [entry, 1]
+        finally:
+            if self.counts is not None:
+                for entry, count in used.values():
+                    for index, uses in entry[6]:
+                        if not self.counts[index]:
+                            self.used.append(index)
+                        self.counts[index] += uses * count
+        if self.state != 0:
+            self.run(max_iterations)
+
+
+# Run that can be stepped backwards. A snapshot of the configuration is
+# kept every interval steps and an undo record for every step since the
+# last one, so seeking costs at most interval steps and a single step
+# either way is constant time
+class DebugSession:
+    def __init__(self, table: DecodedTable, buffer: TapeBuffer, state=1,
+                 interval=1024, max_iterations=5096):
+        self.table = table
+        self.buffer = buffer
+        self.state = state
+        self.iterations = 0
+        self.interval = interval
+        self.max_iterations = max_iterations
+        self.snapshots = []
+        # (cell, old code, old state), with the old begin and end added
+        # when the step read a cell outside of them
+        self.undo = []
+        self._snapshot()
+
+    def _snapshot(self):
+        buffer = self.buffer
+        self.snapshots.append((self.state, bytes(buffer.buffer), buffer.origin,
+                               buffer.pointer, buffer.begin, buffer.end))
+
+    def _restore(self, number):
+        state, data, origin, pointer, begin, end = self.snapshots[number]
+        buffer = self.buffer
+        buffer.buffer = bytearray(data)
+        buffer.origin, buffer.pointer = origin, pointer
+        buffer.begin, buffer.end = begin, end
+        self.state = state
+        self.iterations = number * self.interval
+        self.undo.clear()
+
+    @property
+    def halted(self):
+        return self.state == 0
+
+    def tape(self):
+        return self.buffer.to_tape()
+
+    def step(self):
+        # False when the machine has already stopped
+        before = self.iterations
+        self._forward(before + 1)
+        return self.iterations > before
+
+    def back(self):
+        # False at the start of the run
+        if not self.iterations:
+            return False
+        if not self.undo:
+            target = self.iterations - 1
+            self._restore(target // self.interval)
+            self._forward(target)
+            return True
+        record = self.undo.pop()
+        buffer = self.buffer
+        cell, code, state = record[:3]
+        buffer.buffer[cell - buffer.origin] = code
+        buffer.pointer = cell
+        if len(record) > 3:
+            buffer.begin, buffer.end = record[3:]
+        self.state = state
+        self.iterations -= 1
+        return True
+
+    def seek(self, iteration):
+        # Goes to the configuration after iteration steps, or to the end
+        # of the run when it stops earlier
+        number = min(iteration // self.interval, len(self.snapshots) - 1)
+        start = number * self.interval
+        if iteration < self.iterations - len(self.undo) or \
+                self.iterations < start:
+            self._restore(number)
+        while self.iterations > iteration:
+            self.back()
+        self._forward(iteration)
+
+    def run_until(self, state=None, cell=None):
+        # Runs until a step enters state or writes cell. True when the
+        # breakpoint stopped it, False when the machine stopped
+        return self._forward(float("inf"), state, cell)
+
+    def _forward(self, target, break_state=None, break_cell=None):
+        if self.state == 0 or self.iterations >= target:
+            return False
+        buffer = self.buffer
+        decoded = self.table
+        width = decoded.WIDTH
+        write, shift, next_state = decoded.write, decoded.shift, decoded.next_state
+        undo, snapshots = self.undo, self.snapshots
+        interval = self.interval
+        max_iterations = self.max_iterations
+        state = self.state
+        iterations = self.iterations
+        buf = buffer.buffer
+        origin = buffer.origin
+        size = len(buf)
+        position = buffer.pointer - origin
+        begin = buffer.begin - origin
+        end = buffer.end - origin
+        hit = False
+        try:
+            while state != 0 and iterations < target:
+                if iterations > max_iterations:
+                    raise decoded.limit_error()
+                if position > end or position < begin:
+                    bounds = (origin + begin, origin + end)
+                    if position > end:
+                        end = position
+                    else:
+                        begin = position
+                else:
+                    bounds = None
+                if not 0 <= position < size:
+                    position, begin, end = buffer.reach(position, begin, end)
+                    origin = buffer.origin
+                    size = len(buf)
+                code = buf[position]
+                index = state * width + code
+                new_state = next_state[index]
+                if new_state < 0:
+                    raise decoded.failure(index)
+                cell = origin + position
+                if bounds is None:
+                    undo.append((cell, code, state))
+                else:
+                    undo.append((cell, code, state) + bounds)
+                buf[position] = write[index]
+                position += shift[index]
+                state = new_state
+                iterations += 1
+                if not iterations % interval:
+                    undo.clear()
+                    if iterations // interval == len(snapshots):
+                        snapshots.append((state, bytes(buf), origin,
+                                          origin + position, origin + begin,
+                                          origin + end))
+                if state == break_state or cell == break_cell:
+                    hit = True
+                    break
+        finally:
+            buffer.pointer = origin + position
+            buffer.begin = origin + begin
+            buffer.end = origin + end
+            self.state = state
+            self.iterations = iterations
+        return hit
+
+
+# Runs a machine again after edits of its table. A snapshot is taken
+# every interval steps and the first use of every table cell is kept, so
+# the next run starts from the last snapshot before an edited cell was
+# first used and the steps before it are taken from the previous run
+class IncrementalRun:
+    def __init__(self, machine, tape=None, max_iterations=5096,
+                 interval=4096):
+        self.machine = machine
+        self.tape = tape or machine.tape
+        self.max_iterations = max_iterations
+        self.interval = interval
+        self.decoded = None
+        self.execution = None
+        self.snapshots = []
+        self.first_use = {}
+        # (step, table cell, error) of the previous run, when it failed
+        self.failure = None
+        # Step the last run started from, None when it was all reused
+        self.start = 0
+
+    def _snapshot(self, execution):
+        buffer = execution.buffer
+        self.snapshots.append((
+            execution.state, bytes(buffer.buffer), buffer.origin,
+            buffer.pointer, buffer.begin, buffer.end, buffer._tail,
+            execution.low, execution.high, list(execution.used),
+            [execution.counts[index] for index in execution.used]))
+
+    def _restore(self, number, decoded):
+        (state, data, origin, pointer, begin, end, tail, low, high,
+         used, counts) = self.snapshots[number]
+        buffer = TapeBuffer.restore(
+            bytearray(data), origin, begin, end, pointer, tail)
+        execution = Execution(decoded, buffer)
+        execution.state = state
+        execution.iterations = number * self.interval
+        execution.low, execution.high = low, high
+        execution.used = list(used)
+        for index, count in zip(used, counts):
+            execution.counts[index] = count
+        return execution
+
+    def _first_change(self, decoded):
+        # Step of the first use of a cell changed since the previous run,
+        # None when none of them was used
+        old = self.decoded
+        size = min(len(old.next_state), len(decoded.next_state))
+        steps = []
+        for index, step in self.first_use.items():
+            if index >= size or old.next_state[index] != decoded.next_state[index] \
+                    or old.write[index] != decoded.write[index] \
+                    or old.shift[index] != decoded.shift[index] \
+                    or old.actions[index] != decoded.actions[index]:
+                steps.append(step)
+        if self.failure is not None:
+            step, index, _ = self.failure
+            if index is not None and (
+                    index >= size or old.next_state[index] != decoded.next_state[index]
+                    or old.actions[index] != decoded.actions[index]):
+                steps.append(step)
+        return min(steps, default=None)
+
+    def run(self):
+        # Gives (tape, trace results) as TuringMachine.execute does and
+        # raises the same errors
+        decoded = self.machine.table.decoded
+        if self.decoded is None:
+            execution = Execution(decoded, TapeBuffer(self.tape))
+            self._snapshot(execution)
+            self.start = 0
+        else:
+            start = self._first_change(decoded)
+            self.decoded = decoded
+            if start is None:
+                # The previous run didn't use anything edited
+                self.start = None
+                if self.failure is not None:
+                    raise self.failure[2]
+                execution = self.execution
+                return execution.buffer.to_tape(), execution.trace_results()
+            number = min(start // self.interval, len(self.snapshots) - 1)
+            del self.snapshots[number + 1:]
+            self.start = number * self.interval
+            self.first_use = {index: step
+                              for index, step in self.first_use.items()
+                              if step < self.start}
+            execution = self._restore(number, decoded)
+        self.decoded = decoded
+        self.execution = execution
+        self.failure = None
+        execution.first_use = self.first_use
+        try:
+            while execution.state != 0:
+                until = len(self.snapshots) * self.interval
+                for _ in execution.steps(self.max_iterations, until=until):
+                    pass
+                if execution.iterations == until:
+                    self._snapshot(execution)
+        except TuringRuntimeError as e:
+            index = None
+            if execution.iterations <= self.max_iterations:
+                buffer = execution.buffer
+                index = execution.state * decoded.WIDTH + \
+                    buffer.buffer[buffer.pointer - buffer.origin]
+            self.failure = (execution.iterations, index, e)
+            raise
+        return execution.buffer.to_tape(), execution.trace_results()
+
+
 class TuringMachine:
     HEADER_TEMPLATE = r"^DEFINE\s{0,}Q\s{0,}(\d+);TAPE\s{0,}:\s{0,}(\w{0,});POS\s{0,}:\s{0,}(-?\d{0,});{0,}$"
     COMMAND_TEMPLATE = r"^([^>.<]) [Qq](\d+)\s{0,}:\s{0,}([^>.<])([>.<])[Qq]{0,1}(\d+)$"
     COMMENT_TEMPLATE = r"^COMMENT\s{0,}:\s{0,}(.{0,})$"
     SOLUTION_TEMPLATE = r"^SOLUTION\s{0,}:\s{0,}(.{0,})$"
 
-    def __init__(self, object):
+    def __init__(self, object, strict=False):
         self._comment = ""
         self._solution = ""
         self._table = None
@@ -250,6 +1928,9 @@ class TuringMachine:
             self._solution = object.solution
             self._comment = object.comment
             self._tape = object.tape
+        # Lines without a header give an empty machine, with nothing to check
+        if self._table is not None:
+            self.check(strict)
 
     @property
     def word(self):
@@ -355,80 +2036,216 @@ class TuringMachine:
     def link(self):
         return TuringFile(self.table, self.tape, self.comment, self.solution)
 
+    def check(self, strict=False):
+        # Warns about issues found by Table.analyze, errors are raised
+        # in strict mode
+        for issue in self.table.analyze():
+            if strict and issue.level == "error":
+                raise TuringCompileException(issue.message)
+            warnings.warn(issue.message, TuringWarning, stacklevel=3)
+
+    def prepare(self, tape=None, trace="full"):
+        # Execution of the machine on tape, for runs driven by the caller
+        if not isinstance(tape, TapeBuffer):
+            tape = TapeBuffer(tape or self.tape)
+        return Execution(self.table.decoded, tape, trace=trace)
+
+    def resume(self, path, max_iterations=5096, checkpoint=None,
+               checkpoint_every=None):
+        # Continues a run saved by execute with a checkpoint, the limit
+        # counts the iterations made before it was saved as well
+        if checkpoint_every and not checkpoint:
+            raise ValueError("checkpoint_every requires a checkpoint")
+        execution = Execution.load(path, self.table.decoded)
+        execution.run(max_iterations, checkpoint, checkpoint_every)
+        return execution.buffer.to_tape(), execution.trace_results()
+
+    def debug(self, tape=None, interval=1024, max_iterations=5096):
+        # DebugSession over the machine, see DebugSession
+        if not isinstance(tape, TapeBuffer):
+            tape = TapeBuffer(tape or self.tape)
+        return DebugSession(self.table.decoded, tape,
+                            interval=interval, max_iterations=max_iterations)
+
+    def incremental(self, tape=None, max_iterations=5096, interval=4096):
+        # IncrementalRun of the machine, its run() is repeated after
+        # Table.set_action edits
+        return IncrementalRun(self, tape, max_iterations, interval)
+
+    def iter_steps(self, tape=None, max_iterations=None):
+        # Lazily runs the machine on tape, yielding a Step per step
+        if max_iterations is None:
+            max_iterations = float("inf")
+        execution = self.prepare(tape, trace="none")
+        yield from execution.steps(max_iterations, records=True)
+
+    @staticmethod
+    def print_state(buffer, pointer, state, word):
+        local_pointer = pointer - buffer.begin
+        print(f"Internal debug: Tape[{buffer.begin}:{buffer.end}][{pointer}]: {repr(word)};"
+              f"State: {state}, Local Pointer: {local_pointer}")
+        tape_repr = repr(word[:local_pointer] + ">" + word[local_pointer:])
+        print(f"BEFORE: {tape_repr}, q{state}")
+
+    @staticmethod
+    def print_step(step, buffer):
+        # The bounds the step was made in are only widened to the new
+        # head by the next step
+        word = buffer.to_tape().tape
+        local_pointer = step.pointer - buffer.begin
+        before = word[:local_pointer] + step.read + word[local_pointer + 1:]
+        TuringMachine.print_state(buffer, step.pointer, step.state, before)
+        tape_repr = repr(word[:local_pointer] + ">" + word[local_pointer:])
+        print(f"AFTER: {tape_repr}, q{step.state}->q{step.next_state}")
+
+    def execute_batch(self, tapes, max_iterations=5096):
+        # Runs the machine on all tapes in lockstep, a numpy row per tape.
+        # Gives (tape, summary trace results) per tape, or the
+        # TuringRuntimeError of a failed run in its place
+        if np is None:
+            raise TuringException("numpy is required for batch execution")
+        decoded = self.table.decoded
+        width = decoded.WIDTH
+        write = np.array(decoded.write, dtype=np.uint8)
+        shift = np.array(decoded.shift, dtype=np.int64)
+        next_state = np.array(decoded.next_state, dtype=np.int64)
+        buffers = [TapeBuffer(tape) for tape in tapes]
+        count = len(buffers)
+        margin = max([len(buffer) for buffer in buffers] + [16])
+        cells = np.full((count, 3 * margin), BLANK, dtype=np.uint8)
+        for row, buffer in enumerate(buffers):
+            cells[row, margin:margin + len(buffer)] = \
+                np.frombuffer(buffer.buffer, dtype=np.uint8)
+        # Rows keep their own coordinates, cell index = position + offset
+        offset = margin - np.array([b.origin for b in buffers], dtype=np.int64)
+        heads = np.array([b.pointer for b in buffers], dtype=np.int64) + offset
+        begin = np.array([b.begin for b in buffers], dtype=np.int64) + offset
+        end = np.array([b.end for b in buffers], dtype=np.int64) + offset
+        low, high = heads.copy(), heads.copy()
+        state = np.ones(count, dtype=np.int64)
+        iterations = np.zeros(count, dtype=np.int64)
+        errors = [None] * count
+        rows = np.arange(count)
+        while rows.size:
+            position = heads[rows]
+            if position.min() < 0 or position.max() >= cells.shape[1]:
+                extra = cells.shape[1]
+                cells = np.pad(cells, ((0, 0), (extra, extra)),
+                               constant_values=BLANK)
+                for values in (offset, heads, begin, end, low, high):
+                    values += extra
+                position += extra
+            low[rows] = np.minimum(low[rows], position)
+            high[rows] = np.maximum(high[rows], position)
+            begin[rows] = np.minimum(begin[rows], position)
+            end[rows] = np.maximum(end[rows], position)
+            codes = cells[rows, position]
+            index = state[rows] * width + codes
+            new_state = next_state[index]
+            failed = (iterations[rows] > max_iterations) | (new_state < 0)
+            if failed.any():
+                for row, cell in zip(rows[failed], index[failed]):
+                    if iterations[row] > max_iterations:
+                        errors[row] = decoded.limit_error()
+                    else:
+                        errors[row] = decoded.failure(int(cell))
+                rows, position = rows[~failed], position[~failed]
+                index, new_state = index[~failed], new_state[~failed]
+            cells[rows, position] = write[index]
+            heads[rows] = position + shift[index]
+            state[rows] = new_state
+            iterations[rows] += 1
+            rows = rows[new_state != 0]
+        low = np.minimum(low, heads)
+        high = np.maximum(high, heads)
+        results = []
+        for row, buffer in enumerate(buffers):
+            if errors[row] is not None:
+                results.append(errors[row])
+                continue
+            stop = end[row] + buffer._tail + 1
+            tape = Tape(int(begin[row] - offset[row]), int(end[row] - offset[row]),
+                        int(heads[row] - offset[row]),
+                        cells[row, begin[row]:stop].tobytes().decode("cp1251"))
+            results.append((tape, {
+                "iterations": int(iterations[row]),
+                "used_cells": int(high[row] - low[row] + 1),
+                "head_range": (int(low[row] - offset[row]),
+                               int(high[row] - offset[row]))
+            }))
+        return results
+
     def execute(self,
                 tape=None,
                 max_iterations=5096,
                 debug_prints=False,
-                delay=0):
-        tape = tape or Tape(
-            self.tape.begin, self.tape.end, self.tape.pointer, self.tape.tape)
-        state = 1
-        iterations = 0
-        used_cells = set([tape.pointer])
-        trace_results = {"command_exec_count": {}, "state_use_count": {1: 1}}
-        while state != 0:
-            if tape.pointer > tape.end:
-                tape.tape += " " * (tape.pointer - tape.end)
-                tape.end += (tape.pointer - tape.end)
-            elif tape.pointer < tape.begin:
-                tape.tape = " " * (tape.begin - tape.pointer) + tape.tape
-                tape.begin -= (tape.begin - tape.pointer)
-            local_pointer = tape.pointer - tape.begin
-            if debug_prints:
-                print(f"Internal debug: Tape[{tape.begin}:{tape.end}][{tape.pointer}]: {repr(tape.tape)};"
-                      f"State: {state}, Local Pointer: {local_pointer}")
-                tape_repr = repr(tape.tape[:local_pointer] + ">" + tape.tape[local_pointer:])
-                print(f"BEFORE: {tape_repr}, q{state}")
-            if iterations > max_iterations:
-                raise TuringRuntimeError(
-                    "Max iteration limit has reached. "
-                    "Maybe, machine execution is infinite")
-            action = self.table.action(tape.tape[local_pointer], state)
-            if action is None:
-                raise TuringRuntimeError(
-                    "Action for this state {} and char {} wasn't found".format(
-                        state, tape.tape[local_pointer]))
-            trace_results["command_exec_count"].setdefault(action, 0)
-            trace_results["command_exec_count"][action] += 1
-            if ">" in action:
-                action = action.split(">")
-                shift = 1
-            elif "." in action:
-                action = action.split(".")
-                shift = 0
-            elif "<" in action:
-                action = action.split("<")
-                shift = -1
+                delay=0,
+                block_size=None,
+                detect_loops=False,
+                trace="full",
+                checkpoint=None,
+                checkpoint_every=None,
+                profile=None,
+                compiled=False):
+        # One engine runs the table, checkpoints are made by the plain run
+        engines = [name for name, used in (
+            ("debug_prints" if debug_prints else "delay", debug_prints or delay),
+            ("profile", profile is not None), ("checkpoint", checkpoint),
+            ("detect_loops", detect_loops), ("block_size", block_size),
+            ("compiled", compiled)) if used]
+        if len(engines) > 1:
+            raise ValueError("Options {} can't be used together".format(
+                ", ".join(engines)))
+        if checkpoint_every and not checkpoint:
+            raise ValueError("checkpoint_every requires a checkpoint")
+        if isinstance(tape, TapeBuffer):
+            buffer = tape
+        else:
+            tape = tape or Tape(
+                self.tape.begin, self.tape.end,
+                self.tape.pointer, self.tape.tape)
+            buffer = TapeBuffer(tape)
+        execution = Execution(self.table.decoded, buffer, trace=trace)
+        try:
+            if debug_prints or delay:
+                try:
+                    for step in execution.steps(max_iterations, records=True):
+                        if debug_prints:
+                            self.print_step(step, buffer)
+                        if delay:
+                            time.sleep(delay)
+                except TuringRuntimeError:
+                    # The step that failed is printed before its error
+                    if debug_prints:
+                        self.print_state(buffer, buffer.pointer, execution.state,
+                                         buffer.to_tape().tape)
+                    raise
+            elif profile is not None:
+                execution.run_profiled(max_iterations, profile)
+            elif checkpoint:
+                execution.run(max_iterations, checkpoint, checkpoint_every)
+            elif detect_loops:
+                execution.run_watched(max_iterations)
+            elif block_size:
+                execution.run_blocks(block_size, max_iterations)
+            elif compiled:
+                execution.run_compiled(max_iterations)
             else:
-                raise TuringRuntimeError(
-                    "Invalid action command: {}".format(action))
-            if action[0] == "_":
-                action[0] = ' '
-            tape.tape = tape.tape[:local_pointer] + \
-                action[0] + tape.tape[local_pointer + 1:]
-            tape.pointer += shift
-            used_cells.add(tape.pointer)
-            if debug_prints:
-                tape_repr = repr(tape.tape[:local_pointer] + ">" + tape.tape[local_pointer:])
-                print(f"AFTER: {tape_repr}, q{state}->q{action[1]}")
-            state = int(action[1])
-            trace_results["state_use_count"].setdefault(state, 0)
-            trace_results["state_use_count"][state] += 1
-            iterations += 1
-            time.sleep(delay)
-        trace_results["iterations"] = iterations
-        trace_results["used_cells"] = len(used_cells)
-        return tape, trace_results
-
-
-def compile_file(path):
+                execution.run(max_iterations)
+        finally:
+            if buffer is not tape:
+                buffer.to_tape(tape)
+        return tape, execution.trace_results()
+
+
+def compile_file(path, strict=False):
     name = os.path.splitext(os.path.split(path)[-1])[0]
     with open(path, "r") as fobj:
         lines = fobj.readlines(False)
-    program = TuringMachine(lines)
+    program = TuringMachine(lines, strict)
     with open(os.path.join(os.path.dirname(path), name + ".tur"),
               "wb") as fobj:
-        fobj.write(program.file.to_bytes())
+        program.file.write(fobj)
     return program
 
 
@@ -438,22 +2255,54 @@ def merge_two_programs(file1, file2):
     return program1.merge(program2)
 
 
+def link_programs(files):
+    # Chains the programs, halting in one starts the next. States of every
+    # program are shifted by the number of states before it, so each
+    # action is rewritten once into a fresh table over all the symbols
+    files = [TuringFile.from_bytes(file) for file in files]
+    if not files:
+        raise ValueError("Nothing to link")
+    offsets = []
+    q_count = 0
+    symbols = {}
+    for file in files:
+        offsets.append(q_count)
+        q_count += file.table.q_count
+        symbols.update(dict.fromkeys(file.table.fields))
+    fields = {symbol: [] for symbol in symbols}
+    for number, file in enumerate(files):
+        offset = offsets[number]
+        size = file.table.q_count
+        if number + 1 < len(files):
+            exit = offset + size + 1
+        else:
+            exit = 0
+        for symbol, column in fields.items():
+            source = file.table.fields.get(symbol, [])[:size]
+            for action in source:
+                parsed = Table.split_action(action)
+                if parsed is None:
+                    column.append(action)
+                else:
+                    written, char, state = parsed
+                    state = state + offset if state else exit
+                    column.append(written + char + str(state))
+            column.extend("" for _ in range(size - len(source)))
+    first = files[0]
+    return TuringFile(
+        Table(fields, q_count), first.tape, first.comment, first.solution)
+
+
 def merge_programs(files):
-    files.reverse()
     files = list(
         filter(
             lambda x: os.path.splitext(x)[1] == ".tur",
             files
         )
     )
-    if len(files) >= 2:
-        current = files.pop()
-        print("Первый файл на обработку", current)
-        while len(files) > 0:
-            next = files.pop()
-            print("Обработка файла", next)
-            current = merge_two_programs(current, next)
-    return current
+    for file in files:
+        print("Обработка файла", file)
+    return link_programs(files)
 
 
 if __name__ == "__main__":
@@ -462,11 +2311,24 @@ if __name__ == "__main__":
         prog="Altturing"
     )
 
-    parser.add_argument("action", help="Одно из действий: compile,execute,view,merge")
+    parser.add_argument("action", help="Одно из действий: compile,execute,view,merge,optimize")
     parser.add_argument("path", help="Основной файл для работы или директория (если merge)")
     parser.add_argument("--notrace", action="store_true", help="Вывести только результат, без статистики")
     parser.add_argument("-w", "--word", action="store", help="Исходное слово")
     parser.add_argument("-d", "--debug", action="store_true", default=False, help="Включить пошаговое отображение")
+    parser.add_argument("-s", "--strict", action="store_true", default=False, help="Считать ошибки статической проверки таблицы фатальными")
+    parser.add_argument("-l", "--loops", action="store_true", default=False, help="Обнаруживать бесконечное выполнение")
+    parser.add_argument("-m", "--max", type=int, action="store", default=5096, help="Наибольшее число выполняемых команд")
+    parser.add_argument("--checkpoint", action="store", help="Файл для сохранения состояния выполнения")
+    parser.add_argument("--every", type=int, action="store", help="Сохранять состояние каждые N команд")
+    parser.add_argument("--resume", action="store", help="Продолжить выполнение из сохранённого файла")
+    parser.add_argument("-p", "--profile", action="store_true", default=False, help="Показать профиль движения головки")
+    parser.add_argument("--heatmap", action="store", help="Сохранить число посещений ячеек в .csv или .npz")
+    parser.add_argument("--tape", action="store", help="Файл с содержимым ленты, отображается в память")
+    parser.add_argument("--head", type=int, action="store", default=0, help="Начальное положение головки на ленте из файла")
+    parser.add_argument("-o", "--output", action="store", help="Файл для записи итоговой ленты")
+    parser.add_argument("-c", "--compiled", action="store_true", default=False, help="Выполнять таблицу, скомпилированную в код Python")
+    parser.add_argument("-b", "--block", type=int, action="store", help="Выполнять блоками из указанного числа ячеек (макро-машина)")
 
     args = parser.parse_args()
     if args.action == "compile":
@@ -474,14 +2336,26 @@ if __name__ == "__main__":
             for file in os.listdir(args.path):
                 path = os.path.join(args.path, file)
                 if os.path.splitext(path)[1] == ".alttur":
-                    compile_file(path)
+                    compile_file(path, args.strict)
         else:
-            compile_file(args.path)
+            compile_file(args.path, args.strict)
     elif args.action == "execute":
+        engines = [flag for flag, used in (
+            ("-d", args.debug), ("-p/--heatmap", args.profile or args.heatmap),
+            ("--checkpoint", args.checkpoint), ("-l", args.loops),
+            ("-b", args.block), ("-c", args.compiled)) if used]
+        if args.resume:
+            if args.word or args.tape or engines not in ([], ["--checkpoint"]):
+                parser.error("С --resume можно указать только -m, --checkpoint и --every")
+        elif len(engines) > 1:
+            parser.error("Параметры {} нельзя использовать вместе".format(", ".join(engines)))
+        if args.every and not args.checkpoint:
+            parser.error("--every используется только вместе с --checkpoint")
         if os.path.splitext(args.path)[1] != ".tur":
-            program = compile_file(args.path)
+            program = compile_file(args.path, args.strict)
         else:
-            program = TuringMachine(TuringFile.from_bytes(args.path))
+            program = TuringMachine(TuringFile.from_bytes(args.path), args.strict)
+        mapped = None
         try:
             tape = None
             if args.word:
@@ -492,21 +2366,62 @@ if __name__ == "__main__":
                         len(word[0]), "".join(word))
                 else:
                     tape = Tape(0, len(args.word) - 1, 0, args.word)
-            tape, results = program.execute(tape, debug_prints=args.debug)
-            print(repr(tape.tape))
-            if not args.notrace:
+            if args.tape:
+                tape = mapped = MappedTapeBuffer(args.tape, args.head)
+            profile = TapeProfile() if args.profile or args.heatmap else None
+            if args.resume:
+                tape, results = program.resume(
+                    args.resume, args.max, args.checkpoint, args.every)
+            else:
+                tape, results = program.execute(
+                    tape, args.max, debug_prints=args.debug,
+                    block_size=args.block, detect_loops=args.loops,
+                    trace="none" if args.notrace else "full",
+                    checkpoint=args.checkpoint, checkpoint_every=args.every,
+                    profile=profile, compiled=args.compiled)
+            if args.output:
+                with open(args.output, "wb") as f:
+                    if isinstance(tape, TapeBuffer):
+                        tape.write(f)
+                    else:
+                        f.write(tape.tape.encode("cp1251"))
+                print("Положение головки:", tape.pointer - tape.begin)
+            elif isinstance(tape, TapeBuffer):
+                print(repr(tape.to_tape().tape))
+            else:
+                print(repr(tape.tape))
+            # A resumed run keeps the trace level it was started with
+            if "command_exec_count" in results:
                 print("Выполнено команд: ", results["iterations"])
                 print("Использовано ячеек: ", results["used_cells"])
                 print("Статистика выполненных команд:")
                 for key in results["command_exec_count"]:
                     print(key, results["command_exec_count"][key])
+            if args.profile and profile is not None:
+                print("Разворотов головки:", profile.reversals)
+                print("Самые длинные проходы:")
+                for length, first, last in profile.longest_sweeps():
+                    print("{} ячеек: {} -> {}".format(length, first, last))
+                print("Пройдено ячеек в состояниях:")
+                for state, cells in enumerate(profile.distance):
+                    if cells:
+                        print("q{}".format(state), cells)
+                print("Самые посещаемые ячейки:")
+                histogram = sorted(profile.histogram(), key=lambda item: -item[1])
+                for cell, count in histogram[:TapeProfile.SWEEP_COUNT]:
+                    print(cell, count)
+            if args.heatmap and profile is not None:
+                profile.save(args.heatmap)
         except TuringRuntimeError as e:
             print("Ошибка:", str(e), file=sys.stderr)
+        finally:
+            if mapped is not None:
+                mapped.close()
     elif args.action == "view":
         if os.path.splitext(args.path)[1] != ".tur":
-            program = compile_file(args.path)
+            program = compile_file(args.path, args.strict)
         else:
-            program = TuringMachine(TuringFile.from_bytes(args.path))
+            program = TuringMachine(TuringFile.from_bytes(args.path), args.strict)
         local_pointer = program.tape.pointer - program.tape.begin
         print(
             "DEFINE Q{};TAPE:{};POS:{}".format(
@@ -520,10 +2435,21 @@ if __name__ == "__main__":
                 if program.table.action(symbol, q).strip():
                     print("{} q{}: {}".format(
                         symbol, q, program.table.action(symbol, q)))
+    elif args.action == "optimize":
+        if os.path.splitext(args.path)[1] != ".tur":
+            program = compile_file(args.path, args.strict)
+        else:
+            program = TuringMachine(TuringFile.from_bytes(args.path), args.strict)
+        file = program.file.optimize()
+        print("Состояний: {} -> {}".format(
+            program.table.q_count, file.table.q_count))
+        name = os.path.splitext(args.path)[0] + "_optimized.tur"
+        with open(name, "wb") as fobj:
+            file.write(fobj)
     elif args.action == "merge":
         if not os.path.isdir(args.path):
             args.path = ""
         files = input("Введите названия файлов для объединения по порядку через запятую: ").split(',')
         file = merge_programs(list(map(lambda x: os.path.join(args.path, x), files)))
         with open(os.path.join(args.path, "merged.tur"), "wb") as fobj:
-            fobj.write(file.to_bytes())
+            file.write(fobj)
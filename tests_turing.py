@@ -27,6 +27,15 @@ def get_test_result(word, is_tape_end=True, criteria="iterations"):
     return get_results(form_tape(word, is_tape_end))[1][criteria]
 
 
+def get_test_results(words, is_tape_end=True, criteria="iterations"):
+    results = program.execute_batch(
+        [form_tape(word, is_tape_end) for word in words])
+    for result in results:
+        if isinstance(result, TuringRuntimeError):
+            raise result
+    return [result[1][criteria] for result in results]
+
+
 if __name__ == '__main__':
     results = get_results(tape)
     if results:
@@ -37,3 +46,8 @@ if __name__ == '__main__':
         print("Command count trace:")
         for key in results[1]["command_exec_count"]:
             print(key, results[1]["command_exec_count"][key])
+        # The head may start past the word, as with "-w 311>"
+        past = Tape(0, tape_end, tape_end + 1, tape_word)
+        past_results = get_results(past)
+        print("Head past the word:", repr(past_results[0].tape),
+              past_results[1]["iterations"])